@@ -605,20 +605,23 @@ async def _gather_context(
                 # モデル未導入等でも全体は継続
                 pass
 
-        # インデックス保証後に各書籍で検索
-        for b in book_ids:
-            key = b.replace(".epub", "")
-            try:
-                res = epub_service.embedding_service.search(
-                    query=query, top_k=per_book_top_k, book_id=key
-                )
-                for r in res:
-                    if "error" not in r:
-                        snippets.append(r)
-            except (OSError, ValueError, RuntimeError):
+        # インデックス保証後に各書籍で検索 (クエリのベクトル化は 1 回だけ)
+        keys = [b.replace(".epub", "") for b in book_ids]
+        try:
+            per_book = epub_service.embedding_service.search_books(
+                query, keys, top_k=per_book_top_k
+            )
+        except (OSError, ValueError, RuntimeError):
+            # クエリのベクトル化自体の失敗。書籍ごとの失敗は search_books が None で返す
+            per_book = {}
+        for key in keys:
+            res = per_book.get(key)
+            if res is None:
                 # 書籍単位でフォールバック
                 fb = _fallback_text_search([f"{key}.epub"], query, per_book_top_k)
                 snippets.extend(fb)
+                continue
+            snippets.extend(r for r in res if "error" not in r)
     else:
         try:
             res = epub_service.search_all_books(query, top_k=all_books_top_k)
@@ -1118,22 +1121,17 @@ def get_book_chunks(book_id: str) -> dict[str, Any]:
         return {"error": "Book not found"}
 
     try:
-        # Ensure the book is indexed so chunks_metadata is populated
+        # Ensure the book is indexed so its chunks are available
         key = book_id.replace(".epub", "")
         epub_service.ensure_book_indexed(key, epub_path)
-        # Prefer chunks from the embedding index
-        chunks = [
-            {"chunk_id": md.get("chunk_id"), "text": md.get("text", "")}
-            for md in epub_service.embedding_service.chunks_metadata
-            if md.get("book_id") == key
-        ]
+        # Prefer chunks from the embedding index (only this book's rows)
+        chunks = epub_service.embedding_service.book_chunks(key)
         if chunks:
-            chunks.sort(key=lambda x: int(x.get("chunk_id") or 0))
             return {"book_id": book_id, "chunks": chunks}
 
         # Fallback: reconstruct chunks from markdown cache using the same logic
         try:
-            from src.mlx_embedding_service import _chunk_markdown as chunk_md
+            from src.epub_util import _chunk_markdown as chunk_md
         except Exception:  # noqa: BLE001
             chunk_md = None  # type: ignore[assignment]
 
@@ -3,7 +3,7 @@
 主目的:
  - テキスト群をベクトル化 (開発/テスト時は疑似決定論ベクトル)
  - FAISS インデックス作成 / 検索
- - 埋め込み/テキストの永続化 (npy + json)
+ - 埋め込み/テキストの永続化 (npy + json, 任意で FAISS インデックス .faiss)
  - RAG 用簡易コンテキスト組み立て
 
 本ファイルは test_embedding_util*.py の要求を満たす最小 API を提供する。
@@ -13,14 +13,34 @@ from __future__ import annotations
 
 import hashlib
 import json
+import mmap
+import os
 from collections.abc import Iterable, Sequence
 from dataclasses import dataclass
+from types import ModuleType
 from typing import Any, cast
 
 import faiss
 import numpy as np
 
+# orjson is optional; stdlib json is used when missing
+orjson: ModuleType | None
+try:
+    import orjson as _orjson
+
+    orjson = _orjson
+except ModuleNotFoundError:  # pragma: no cover - fallback when orjson missing
+    orjson = None  # pylint: disable=invalid-name
+
 EMBED_DIM_DEV = 1024
+# build_faiss_index のインデックス種別 ("flat" | "fp16" | "sq8" | "ivfpq")
+INDEX_TYPE_ENV = "RAG_INDEX_TYPE"
+# IVF+PQ 設定。PQ 8bit 符号表 (256 セントロイド) の学習に 256 × 39 件程度が必要で、
+# 不足する小規模コーパスや、次元がサブ量子化器数で割り切れない場合は flat にする
+_IVFPQ_PQ_M = 16
+_IVFPQ_FACTORY = f"IVF64,PQ{_IVFPQ_PQ_M}x8"
+_IVFPQ_MIN_TRAIN = 256 * 39
+_IVFPQ_NPROBE = 8
 
 
 @dataclass(frozen=True)
@@ -31,12 +51,18 @@ class ModelPair:
     tokenizer: Any | None
 
 
-def _hash_to_vec(text: str, dim: int) -> np.ndarray:
-    """テキストをハッシュし擬似決定論ベクトルへ。"""
-    h = hashlib.sha256(text.encode("utf-8")).digest()
-    raw = (h * ((dim // len(h)) + 1))[:dim]
-    arr = np.frombuffer(raw, dtype=np.uint8).astype(np.float32)
-    arr /= np.linalg.norm(arr) + 1e-9
+def _hash_to_matrix(texts: Sequence[str], dim: int) -> np.ndarray:
+    """各テキストをハッシュし擬似決定論ベクトル (行) へ。
+
+    ダイジェストを連結して一度に行列化し、タイル展開と正規化を numpy で
+    まとめて行う (テキスト毎の Python ループはハッシュ計算のみ)。
+    """
+    # SHA-256 ダイジェストは 32 バイト固定
+    digests = b"".join(hashlib.sha256(t.encode("utf-8")).digest() for t in texts)
+    raw = np.frombuffer(digests, dtype=np.uint8).reshape(len(texts), 32)
+    reps = dim // 32 + 1
+    arr = np.tile(raw, (1, reps))[:, :dim].astype(np.float32)
+    arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-9
     return arr
 
 
@@ -50,11 +76,14 @@ def create_embeddings_from_texts(
     """
     del tokenizer  # 現状未使用
     if model is None:
-        vecs = [_hash_to_vec(t, EMBED_DIM_DEV) for t in texts]
-        return np.vstack(vecs).astype(np.float32)
+        return _hash_to_matrix(texts, EMBED_DIM_DEV)
     raise RuntimeError("実モデル埋め込みは未実装です (テスト目的)。")
 
 
+def _index_type() -> str:
+    return os.getenv(INDEX_TYPE_ENV, "flat").lower()
+
+
 def build_faiss_index(embeddings: np.ndarray) -> faiss.Index:
     """FAISS インデックスを構築 (1D 可)。"""
     if embeddings.ndim == 1:
@@ -66,53 +95,203 @@ def build_faiss_index(embeddings: np.ndarray) -> faiss.Index:
     norms = np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-9
     embeddings = embeddings / norms
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
+    index_type = _index_type()
+    index: faiss.Index
+    if index_type == "sq8":
+        # 8bit スカラー量子化: 1 ベクトルあたりのバイト数を 1/4 にし走査帯域を削減
+        index = faiss.IndexScalarQuantizer(
+            dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(embeddings)
+    elif index_type == "fp16":
+        # fp16 保持: 精度をほぼ保ったまま走査帯域と RAM を半減 (学習不要)
+        index = faiss.IndexScalarQuantizer(
+            dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+        )
+    elif (
+        index_type == "ivfpq"
+        and embeddings.shape[0] >= _IVFPQ_MIN_TRAIN
+        and dim % _IVFPQ_PQ_M == 0
+    ):
+        # 粗量子化で探索セルを絞り、距離は PQ 符号 (16 バイト/ベクトル) 上で計算
+        index = faiss.index_factory(dim, _IVFPQ_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        faiss.extract_index_ivf(index).nprobe = _IVFPQ_NPROBE
+    else:
+        index = faiss.IndexFlatIP(dim)
     index.add(embeddings)
     return index
 
 
 def save_embeddings(
-    embeddings: np.ndarray, texts: Sequence[str], base_path: str
+    embeddings: np.ndarray,
+    texts: Sequence[str],
+    base_path: str,
+    *,
+    dtype: str = "float32",
 ) -> None:
-    np.save(base_path + ".npy", embeddings.astype(np.float32))
-    with open(base_path + ".json", "w", encoding="utf-8") as f:
-        json.dump(list(texts), f, ensure_ascii=False)
-
+    """埋め込みとテキストを保存する。
 
-def load_embeddings(base_path: str) -> tuple[np.ndarray, list[str]]:
-    emb = np.load(base_path + ".npy").astype(np.float32)
-    with open(base_path + ".json", encoding="utf-8") as f:
-        texts = json.load(f)
+    dtype="float16" を指定すると .npy のサイズと読込帯域が半分になる
+    (load_embeddings は float32 に戻して返す)。
+    .npy は置き換えで書くため、読込済みの mmap を渡して同じパスへ保存できる。
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"unsupported dtype: {dtype}")
+    # load_embeddings が返す mmap が同じ .npy を参照していることがあるため、
+    # 一時ファイルに書いてから置き換える (旧 inode は mmap が閉じるまで残る)
+    tmp_path = f"{base_path}.npy.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as fb:
+            np.save(fb, embeddings.astype(dtype, copy=False))
+        os.replace(tmp_path, base_path + ".npy")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if orjson is not None:
+        # orjson は UTF-8 のまま出力するため ensure_ascii=False の json と同形式
+        with open(base_path + ".json", "wb") as fb:
+            fb.write(orjson.dumps(list(texts)))
+    else:
+        with open(base_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(list(texts), f, ensure_ascii=False)
+    # 埋め込みを書き換えたら派生物の .faiss / .sig は古くなるため消す
+    for stale in (base_path + ".faiss", base_path + ".faiss.sig", base_path + ".sig"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def save_faiss_index(index: faiss.Index, base_path: str) -> None:
+    """構築済みインデックスを ``<base_path>.faiss`` に保存する。"""
+    faiss.write_index(index, base_path + ".faiss")
+
+
+def load_faiss_index(base_path: str) -> faiss.Index | None:
+    """``<base_path>.faiss`` を mmap (読み取り専用) で開く。無ければ None。
+
+    ページキャッシュを共有するためプロセス間で重複して RAM を使わない。
+    返るインデックスへの add はできない。
+    """
+    path = base_path + ".faiss"
+    if not os.path.exists(path):
+        return None
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+def _load_texts(base_path: str) -> list[str]:
+    if orjson is not None:
+        with open(base_path + ".json", "rb") as fb:
+            texts = orjson.loads(fb.read())
+    else:
+        with open(base_path + ".json", encoding="utf-8") as f:
+            texts = json.load(f)
     if not isinstance(texts, list):
         raise ValueError("invalid texts json")
-    return emb, [str(t) for t in texts]
+    return [str(t) for t in texts]
+
+
+def _advise_sequential(arr: np.ndarray) -> None:
+    """mmap 配列に順次読みのヒントを与える (非対応 OS では何もしない)。
+
+    MADV_WILLNEED は全体を先読みさせ遅延ページングの利点を失うため使わない。
+    """
+    buf = arr.base
+    if not isinstance(buf, mmap.mmap) or not hasattr(mmap, "MADV_SEQUENTIAL"):
+        return
+    try:
+        buf.madvise(mmap.MADV_SEQUENTIAL)
+    except OSError:
+        pass  # ヒントのみのため失敗しても読込自体は継続できる
+
+
+def load_embeddings(base_path: str) -> tuple[np.ndarray, list[str]]:
+    """埋め込みとテキストを読込む。
+
+    .npy は mmap (読み取り専用) で開き、実際に触れたページだけを読込む。
+    直後のインデックス構築は全行を先頭から走査するため順次読みを OS に伝える。
+    float32 以外で保存されている場合のみ変換コピーを作る。
+    """
+    emb = np.load(base_path + ".npy", mmap_mode="r")
+    _advise_sequential(emb)
+    if emb.dtype != np.float32:
+        emb = emb.astype(np.float32)
+    return emb, _load_texts(base_path)
+
+
+def _embedding_signature(texts: Sequence[str], model: Any | None, dtype: str) -> str:
+    """入力テキスト列 (順序込み)・モデル種別・保存 dtype から保存物の署名を作る。"""
+    h = hashlib.blake2b(digest_size=16)
+    tag = "dev" if model is None else f"{type(model).__module__}.{type(model).__name__}"
+    h.update(f"{tag}\0{dtype}\0{len(texts)}".encode())
+    for t in texts:
+        h.update(b"\0")
+        h.update(t.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _read_signature(base_path: str, ext: str = ".sig") -> str | None:
+    try:
+        with open(base_path + ext, encoding="ascii") as f:
+            return f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
 
 
 def embed_texts_and_save(
-    texts: Sequence[str], base_path: str, model: Any | None, tokenizer: Any | None
+    texts: Sequence[str],
+    base_path: str,
+    model: Any | None,
+    tokenizer: Any | None,
+    *,
+    with_index: bool = False,
+    dtype: str = "float32",
 ) -> np.ndarray:
-    emb = create_embeddings_from_texts(texts, model, tokenizer)
-    save_embeddings(emb, texts, base_path)
+    """埋め込みを作成・保存する。with_index=True なら FAISS インデックスも保存。
+
+    同じテキスト列・モデル・dtype で保存済み (``<base_path>.sig`` が一致) なら
+    埋め込み計算と書き込みを省略し、保存済みの埋め込みを返す。``.faiss`` は
+    構築時のインデックス種別を ``<base_path>.faiss.sig`` に残し、
+    RAG_INDEX_TYPE が変わっていれば作り直す。
+    """
+    sig = _embedding_signature(texts, model, dtype)
+    saved = all(os.path.exists(base_path + ext) for ext in (".npy", ".json"))
+    if saved and _read_signature(base_path) == sig:
+        # 呼び出し側が保持・再保存しても安全なよう mmap ではなく実体を返す
+        emb = np.array(load_embeddings(base_path)[0])
+    else:
+        emb = create_embeddings_from_texts(texts, model, tokenizer)
+        save_embeddings(emb, texts, base_path, dtype=dtype)
+        with open(base_path + ".sig", "w", encoding="ascii") as f:
+            f.write(sig)
+    if with_index:
+        index_type = _index_type()
+        if not os.path.exists(base_path + ".faiss") or (
+            _read_signature(base_path, ".faiss.sig") != index_type
+        ):
+            save_faiss_index(build_faiss_index(emb), base_path)
+            with open(base_path + ".faiss.sig", "w", encoding="ascii") as f:
+                f.write(index_type)
     return emb
 
 
-def _encode_query(query: str, pair: ModelPair, dim: int) -> np.ndarray:
-    """Encode query into an embedding vector.
+def _encode_queries(queries: Sequence[str], pair: ModelPair, dim: int) -> np.ndarray:
+    """Encode queries into a ``(len(queries), d)`` embedding matrix.
 
-    - If model is None: use deterministic hash vector of target ``dim``.
-    - If model is provided: try common paths used by test doubles
-      (``text_embeds`` or mean-pooled ``last_hidden_state``).
+    - If model is None: use deterministic hash vectors of target ``dim``.
+    - If model is provided: tokenize all queries in one batch and run a single
+      forward pass, reading ``text_embeds`` or mask-aware mean-pooled
+      ``last_hidden_state`` (the paths used by test doubles).
     """
     if pair.model is None:
-        return _hash_to_vec("__q__" + query, dim).reshape(1, -1)
-    # Tokenize single query (tests provide simple numpy outputs)
+        return _hash_to_matrix(["__q__" + q for q in queries], dim)
     if pair.tokenizer is None:
         raise RuntimeError("tokenizer is required when model is provided")
-    tok = pair.tokenizer.batch_encode_plus([query])
+    # 長さの異なるクエリを 1 回の forward に載せるため同じ長さに揃える
+    tok = pair.tokenizer.batch_encode_plus(list(queries), padding=True, truncation=True)
     input_ids = tok.get("input_ids")
     attention_mask = tok.get("attention_mask")
     out = pair.model(input_ids, attention_mask)
-    # Path 1: model returns text_embeds (1, d)
+    # Path 1: model returns text_embeds (b, d)
     vec = getattr(out, "text_embeds", None)
     if vec is not None:
         arr = np.asarray(vec, dtype=np.float32)
@@ -124,7 +303,15 @@ def _encode_query(query: str, pair: ModelPair, dim: int) -> np.ndarray:
         arr = np.asarray(last, dtype=np.float32)
         if arr.ndim != 3:
             raise RuntimeError("invalid last_hidden_state shape")
-        pooled = arr.mean(axis=1, keepdims=False)
+        mask = None
+        if attention_mask is not None:
+            mask = np.asarray(attention_mask, dtype=np.float32)
+        if mask is not None and mask.shape == arr.shape[:2]:
+            # バッチ内のパディングを平均に含めない
+            summed = (arr * mask[:, :, None]).sum(axis=1)
+            pooled = summed / np.maximum(mask.sum(axis=1, keepdims=True), 1e-9)
+        else:
+            pooled = arr.mean(axis=1, keepdims=False)
         reshaped = pooled.reshape(pooled.shape[0], -1)
         return cast(np.ndarray, reshaped)
     raise RuntimeError(
@@ -132,6 +319,72 @@ def _encode_query(query: str, pair: ModelPair, dim: int) -> np.ndarray:
     )
 
 
+def _embed_queries(queries: Sequence[str], pair: ModelPair, dim: int) -> np.ndarray:
+    qv = _encode_queries(queries, pair, dim)
+    if qv.shape[1] != dim:
+        raise ValueError("query embedding dimension mismatch")
+    qv = qv / (np.linalg.norm(qv, axis=1, keepdims=True) + 1e-9)
+    return np.ascontiguousarray(qv, dtype=np.float32)
+
+
+def embed_query(query: str, pair: ModelPair, dim: int) -> np.ndarray:
+    """Return the L2-normalized ``(dim,)`` embedding of ``query``.
+
+    Encode once and pass the vector to ``search_similar_with_vector`` when the
+    same query is run against several indexes (e.g. one per book).
+    """
+    return cast(np.ndarray, _embed_queries([query], pair, dim)[0])
+
+
+def _search_vectors(
+    qv: np.ndarray, index: faiss.Index, texts: Sequence[str], top_k: int
+) -> list[list[tuple[int, float, str]]]:
+    if not isinstance(index, faiss.Index):
+        raise TypeError("index must be FAISS Index")
+    top_k = max(1, min(top_k, len(texts)))
+    scores, idx = index.search(qv, top_k)
+    out: list[list[tuple[int, float, str]]] = []
+    for row_ids, row_scores in zip(idx, scores, strict=False):
+        res: list[tuple[int, float, str]] = []
+        for rank, (i, sc) in enumerate(zip(row_ids, row_scores, strict=False), start=1):
+            if 0 <= i < len(texts):
+                res.append((rank, float(sc), texts[i]))
+        out.append(res)
+    return out
+
+
+def search_similar_with_vector(
+    query_vec: np.ndarray,
+    index: faiss.Index,
+    texts: Sequence[str],
+    top_k: int = 5,
+) -> list[tuple[int, float, str]]:
+    """Search with a precomputed query vector (see ``embed_query``)."""
+    qv = np.ascontiguousarray(query_vec, dtype=np.float32).reshape(1, -1)
+    if isinstance(index, faiss.Index) and qv.shape[1] != index.d:
+        raise ValueError("query embedding dimension mismatch")
+    return _search_vectors(qv, index, texts, top_k)[0]
+
+
+def search_similar_batch(
+    queries: Sequence[str],
+    pair: ModelPair,
+    index: faiss.Index,
+    texts: Sequence[str],
+    top_k: int = 5,
+) -> list[list[tuple[int, float, str]]]:
+    """Search several queries with one encode pass and one ``index.search``.
+
+    FAISS parallelizes over query rows, so a batched ``(Nq, d)`` search is
+    cheaper than ``Nq`` single-vector calls. Returns one hit list per query.
+    """
+    if not isinstance(index, faiss.Index):
+        raise TypeError("index must be FAISS Index")
+    if not queries:
+        return []
+    return _search_vectors(_embed_queries(queries, pair, index.d), index, texts, top_k)
+
+
 def search_similar(
     query: str,
     pair: ModelPair,
@@ -139,20 +392,7 @@ def search_similar(
     texts: Sequence[str],
     top_k: int = 5,
 ) -> list[tuple[int, float, str]]:
-    if not isinstance(index, faiss.Index):
-        raise TypeError("index must be FAISS Index")
-    top_k = max(1, min(top_k, len(texts)))
-    dim = index.d
-    qv = _encode_query(query, pair, dim)
-    if qv.shape[1] != dim:
-        raise ValueError("query embedding dimension mismatch")
-    qv = qv / (np.linalg.norm(qv, axis=1, keepdims=True) + 1e-9)
-    scores, idx = index.search(qv, top_k)
-    res: list[tuple[int, float, str]] = []
-    for rank, (i, sc) in enumerate(zip(idx[0], scores[0], strict=False), start=1):
-        if 0 <= i < len(texts):
-            res.append((rank, float(sc), texts[i]))
-    return res
+    return search_similar_batch([query], pair, index, texts, top_k=top_k)[0]
 
 
 def create_context_from_query(
@@ -173,8 +413,13 @@ def load_and_search(
     model_pair: ModelPair,
     top_k: int = 5,
 ) -> list[tuple[int, float, str]]:
-    emb, texts = load_embeddings(base_path)
-    index = build_faiss_index(emb)
+    # 保存済みインデックスがあれば再構築 (学習・add) を省略
+    index = load_faiss_index(base_path)
+    if index is not None:
+        texts = _load_texts(base_path)
+    else:
+        emb, texts = load_embeddings(base_path)
+        index = build_faiss_index(emb)
     return search_similar(query, model_pair, index, texts, top_k=top_k)
 
 
@@ -195,8 +440,13 @@ __all__ = [
     "build_faiss_index",
     "save_embeddings",
     "load_embeddings",
+    "save_faiss_index",
+    "load_faiss_index",
     "embed_texts_and_save",
+    "embed_query",
     "search_similar",
+    "search_similar_batch",
+    "search_similar_with_vector",
     "create_context_from_query",
     "load_and_search",
     "iter_batch",
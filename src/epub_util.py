@@ -10,12 +10,22 @@ import logging
 import os
 import re
 from collections.abc import Iterator
+from types import ModuleType
 from typing import TYPE_CHECKING, Any, cast
 
 import ebooklib
 from bs4 import BeautifulSoup, Tag
 from ebooklib import ITEM_COVER, epub
 
+# SIMD base64 for inlined images; stdlib fallback has the same API
+_b64: ModuleType
+try:
+    import pybase64 as _pybase64
+
+    _b64 = _pybase64
+except ModuleNotFoundError:  # pragma: no cover - fallback when pybase64 missing
+    _b64 = base64
+
 try:  # Pillow is optional for tests
     from PIL import Image, UnidentifiedImageError
 except ModuleNotFoundError:  # pragma: no cover - fallback when Pillow missing
@@ -35,6 +45,21 @@ if TYPE_CHECKING:
 else:
     EpubBook = Any
 
+_PARA_RE = re.compile(r"\n\s*\n")
+_MAIN_CHAPTER_RES = tuple(
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r"^\d+章",
+        r"^第\d+章",
+        r"^Chapter\s+\d+",
+        r"^CHAPTER\s+\d+",
+        r"^\d+\.?\s*[^\.]*$",
+        r"^Part\s+\d+",
+        r"^第\d+部",
+    )
+)
+_SECTION_NUM_RE = re.compile(r"\d+\.")
+
 
 def extract_epub_text(epub_path: str, cache_path: str) -> str:
     """Extract text content from an EPUB file with caching.
@@ -63,7 +88,7 @@ def extract_epub_text(epub_path: str, cache_path: str) -> str:
 
     # Extract content and metadata
     md_body_lines = _extract_document_content(book)
-    metadata = extract_epub_metadata(epub_path)
+    metadata = extract_epub_metadata(epub_path, book=book)
 
     # Build markdown content
     result = _build_markdown_content(metadata, md_body_lines)
@@ -102,7 +127,7 @@ def _extract_document_content(book: "EpubBook") -> list[str]:
                     alt = tag.get("alt", "")
                     mime = getattr(img_item, "media_type", "image")
                     try:
-                        b64 = base64.b64encode(img_item.get_content()).decode("ascii")
+                        b64 = _b64.b64encode(img_item.get_content()).decode("ascii")
                         md_body_lines.append(f"![{alt}](data:{mime};base64,{b64})")
                     except (OSError, ValueError):
                         continue
@@ -111,6 +136,37 @@ def _extract_document_content(book: "EpubBook") -> list[str]:
     return md_body_lines
 
 
+def _iter_paragraphs(md: str) -> Iterator[str]:
+    """Yield stripped, non-empty paragraphs without materializing a split list."""
+    pos = 0
+    for m in _PARA_RE.finditer(md):
+        if para := md[pos : m.start()].strip():
+            yield para
+        pos = m.end()
+    if para := md[pos:].strip():
+        yield para
+
+
+def _iter_markdown_chunks(md: str, *, max_chars: int = 800) -> Iterator[str]:
+    """Lazily group paragraphs into chunks of about ``max_chars`` characters."""
+    buf: list[str] = []
+    total = 0
+    emitted = False
+    for para in _iter_paragraphs(md):
+        size = len(para)
+        if total + size > max_chars and buf:
+            yield "\n".join(buf)
+            emitted = True
+            buf = []
+            total = 0
+        buf.append(para)
+        total += size + 1
+    if buf:
+        yield "\n".join(buf)
+    elif not emitted:
+        yield md[:max_chars]
+
+
 def _chunk_markdown(md: str, *, max_chars: int = 800) -> list[str]:
     """Split markdown into roughly equal sized chunks.
 
@@ -121,20 +177,7 @@ def _chunk_markdown(md: str, *, max_chars: int = 800) -> list[str]:
     Returns:
         List of chunk strings.
     """
-    paras = [p.strip() for p in re.split(r"\n\s*\n", md) if p.strip()]
-    chunks: list[str] = []
-    buf: list[str] = []
-    total = 0
-    for para in paras:
-        if total + len(para) > max_chars and buf:
-            chunks.append("\n".join(buf))
-            buf = []
-            total = 0
-        buf.append(para)
-        total += len(para) + 1
-    if buf:
-        chunks.append("\n".join(buf))
-    return chunks or [md[:max_chars]]
+    return list(_iter_markdown_chunks(md, max_chars=max_chars))
 
 
 def stream_epub_markdown(
@@ -144,6 +187,8 @@ def stream_epub_markdown(
 
     The function ensures the EPUB is converted to markdown (using cache when
     available) and then yields chunks suitable for streaming to a client.
+    Chunks are produced lazily, so the first one is sent before the rest of
+    the book has been split.
 
     Args:
         epub_path: Path to the EPUB file.
@@ -154,7 +199,7 @@ def stream_epub_markdown(
         Dictionaries containing ``chunk_id`` and ``text`` keys.
     """
     md = extract_epub_text(epub_path, cache_path)
-    for idx, chunk in enumerate(_chunk_markdown(md, max_chars=max_chars)):
+    for idx, chunk in enumerate(_iter_markdown_chunks(md, max_chars=max_chars)):
         yield {"chunk_id": idx, "text": chunk}
 
 
@@ -181,18 +226,47 @@ def _save_to_cache(cache_path: str, content: str) -> None:
     logging.debug("extract_epub_text: saved cache to %s", cache_path)
 
 
-def extract_epub_metadata(epub_path: str) -> dict[str, str]:
+# (path, mtime_ns, size) -> metadata. Successful reads only; cleared when full.
+_METADATA_CACHE: dict[tuple[str, int, int], dict[str, str]] = {}
+_METADATA_CACHE_MAX = 1024
+
+
+def extract_epub_metadata(
+    epub_path: str, *, book: "EpubBook | None" = None
+) -> dict[str, str]:
     """Extract metadata from an EPUB file.
 
+    Results are memoized per (path, mtime, size), so repeated lookups for an
+    unchanged file skip re-reading the EPUB archive.
+
     Args:
         epub_path: Path to the EPUB file.
+        book: Already parsed book for ``epub_path``; reused on a cache miss
+            instead of parsing the archive a second time.
 
     Returns:
         Dictionary containing metadata fields like title, creator, etc.
     """
+    try:
+        st = os.stat(epub_path)
+    except OSError:
+        return _read_epub_metadata(epub_path, book=book)
+    key = (epub_path, st.st_mtime_ns, st.st_size)
+    cached = _METADATA_CACHE.get(key)
+    if cached is None:
+        cached = _read_epub_metadata(epub_path, cache_key=key, book=book)
+    return dict(cached)
+
+
+def _read_epub_metadata(
+    epub_path: str,
+    cache_key: tuple[str, int, int] | None = None,
+    book: "EpubBook | None" = None,
+) -> dict[str, str]:
     meta = {"title": "", "author": "", "year": ""}
     try:
-        book = epub.read_epub(epub_path)
+        if book is None:
+            book = epub.read_epub(epub_path)
         title = book.get_metadata("DC", "title")
         if title and len(title) > 0:
             meta["title"] = title[0][0]
@@ -204,6 +278,11 @@ def extract_epub_metadata(epub_path: str) -> dict[str, str]:
             meta["year"] = date[0][0]
     except (OSError, ValueError) as e:
         logging.warning("extract_epub_metadata: %s", e)
+        return meta
+    if cache_key is not None:
+        if len(_METADATA_CACHE) >= _METADATA_CACHE_MAX:
+            _METADATA_CACHE.clear()
+        _METADATA_CACHE[cache_key] = dict(meta)
     return meta
 
 
@@ -247,21 +326,9 @@ def _should_skip_title(title: str) -> bool:
 
 def _is_main_chapter_title(title: str) -> bool:
     """Check if a title looks like a main chapter (not subsection)."""
-    main_chapter_patterns = [
-        r"^\d+章",
-        r"^第\d+章",
-        r"^Chapter\s+\d+",
-        r"^CHAPTER\s+\d+",
-        r"^\d+\.?\s*[^\.]*$",
-        r"^Part\s+\d+",
-        r"^第\d+部",
-    ]
-
-    if any(
-        re.match(pattern, title, re.IGNORECASE) for pattern in main_chapter_patterns
-    ):
+    if any(pattern.match(title) for pattern in _MAIN_CHAPTER_RES):
         # Additional check: skip subsections (containing multiple dots/numbers)
-        if "." in title and len(re.findall(r"\d+\.", title)) > 1:
+        if "." in title and len(_SECTION_NUM_RE.findall(title)) > 1:
             return False
         return True
     return False
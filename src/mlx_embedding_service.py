@@ -5,7 +5,7 @@
  - search(query, top_k, book_id=None)
  - load_index()/save_index() 永続化
  - get_stats() で total_books, total_chunks, index_dimension 等返却
- - 属性 chunks_metadata を持つ (list[dict])
+ - 属性 chunks_metadata を持つ (list[dict]; 内部は列指向で保持)
 
 本実装は MLX モデル (mlx-lm) が利用可能な場合はロード試行し、失敗時に
 明示的 RuntimeError を投げる (テスト側が skip 可能なメッセージ語句含む)。
@@ -14,59 +14,135 @@
 
 from __future__ import annotations
 
+import functools
 import json
 import logging
 import os
 import pickle
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any
 
 import faiss
 import numpy as np
 
-from .epub_util import extract_epub_text
+# 開発用ハッシュベクトルは embedding_util と共通 (行ごとに L2 正規化済み)
+from .embedding_util import _hash_to_matrix
+
+# チャンク分割は stream_epub_markdown と共通
+from .epub_util import _chunk_markdown, extract_epub_text
 
 LOGGER = logging.getLogger(__name__)
 
 
 def _norm(arr: np.ndarray) -> np.ndarray:
-    arr = arr.astype(np.float32)
-    arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-9
+    """行単位で L2 正規化する。float32 入力はコピーせず in-place で書き換える。"""
+    if arr.dtype != np.float32:
+        arr = arr.astype(np.float32)
+    # 行ごとの二乗和を 1 パスで求め、逆数を掛けて in-place で正規化
+    sq = np.einsum("ij,ij->i", arr, arr)
+    arr *= (1.0 / (np.sqrt(sq) + 1e-9)).astype(np.float32)[:, None]
     return arr
 
 
-def _hash_vec(text: str, dim: int) -> np.ndarray:
-    import hashlib
+def _query_vecs(queries: list[str], dim: int) -> np.ndarray:
+    """検索クエリを正規化済みの (Nq, dim) 行列にする。"""
+    return _hash_to_matrix(["__q__" + q for q in queries], dim)
+
+
+# 書籍内検索用 HNSW パラメータ。HNSW は float32 ベクトルとグラフを別に持つため、
+# チャンク数が _HNSW_MIN_ROWS 未満の書籍は fp16 の保持分を直接走査する (厳密検索)
+_HNSW_MIN_ROWS = 2_000
+_HNSW_M = 32
+_HNSW_EF_CONSTRUCTION = 40
+_HNSW_EF_SEARCH = 16
+
+
+def _build_corpus_index(dim: int) -> faiss.Index:
+    # fp16 スカラー量子化: 走査帯域と RAM を float32 比で半減 (学習不要)
+    return faiss.IndexScalarQuantizer(
+        dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+    )
+
+
+def _build_book_index(mat: np.ndarray) -> faiss.IndexHNSWFlat:
+    index = faiss.IndexHNSWFlat(mat.shape[1], _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = _HNSW_EF_CONSTRUCTION
+    index.add(mat)
+    return index
+
+
+# プロセス単位の FAISS OpenMP スレッド数。未指定なら FAISS / OpenMP の既定
+# (OMP_NUM_THREADS または全コア) のままにし、search_batch や IVF 学習の並列化を
+# 残す。単一クエリの並行リクエストが中心の運用では 1 を指定すると過剰割当を防げる。
+FAISS_THREADS_ENV = "FAISS_THREADS"
+
+
+@functools.cache
+def configure_faiss_threads() -> int:
+    """FAISS の OpenMP スレッド数をプロセスで一度だけ設定し、その値を返す。"""
+    raw = os.getenv(FAISS_THREADS_ENV)
+    if raw is None:
+        return int(faiss.omp_get_max_threads())
+    try:
+        threads = max(1, int(raw))
+    except ValueError:
+        LOGGER.warning("Invalid %s=%r; keeping FAISS default", FAISS_THREADS_ENV, raw)
+        return int(faiss.omp_get_max_threads())
+    faiss.omp_set_num_threads(threads)
+    LOGGER.debug("FAISS OpenMP threads: %d", threads)
+    return threads
+
+
+# FAISS_GPU=1 かつ GPU が見えるときだけコーパス検索を GPU へ載せる
+FAISS_GPU_ENV = "FAISS_GPU"
+
+
+def _gpu_available() -> bool:
+    # CPU 版ホイールには get_num_gpus が無い場合がある
+    get_num_gpus = getattr(faiss, "get_num_gpus", None)
+    return get_num_gpus is not None and get_num_gpus() > 0
+
+
+def _gpu_enabled() -> bool:
+    return os.getenv(FAISS_GPU_ENV) == "1" and _gpu_available()
 
-    h = hashlib.sha256(text.encode("utf-8")).digest()
-    raw = (h * ((dim // len(h)) + 1))[:dim]
-    v = np.frombuffer(raw, dtype=np.uint8).astype(np.float32)
-    v /= np.linalg.norm(v) + 1e-9
-    return v
 
+def _index_to_gpu(index: faiss.Index, res: Any) -> faiss.Index:
+    """コーパスを fp16 の GPU flat IP インデックスへ複製する。"""
+    # IndexScalarQuantizer は GPU 実装が無いため flat へ展開してから転送
+    flat = faiss.IndexFlatIP(index.d)
+    if index.ntotal:
+        flat.add(index.reconstruct_n(0, index.ntotal))
+    opts = faiss.GpuClonerOptions()
+    opts.useFloat16 = True
+    return faiss.index_cpu_to_gpu(res, 0, flat, opts)
 
-def _chunk_markdown(md: str, *, max_chars: int = 800) -> list[str]:
-    paras = [p.strip() for p in re.split(r"\n\s*\n", md) if p.strip()]
-    chunks: list[str] = []
-    buf: list[str] = []
-    total = 0
-    for para in paras:
-        if total + len(para) > max_chars and buf:
-            chunks.append("\n".join(buf))
-            buf = []
-            total = 0
-        buf.append(para)
-        total += len(para) + 1
-    if buf:
-        chunks.append("\n".join(buf))
-    return chunks or [md[:max_chars]]
+
+# 単一クエリ検索をベクトル方向に分割して並列走査する (IndexFlat 系はクエリ方向
+# にしか並列化しないため)。分割数は FAISS_SHARD_T で、未指定なら分割しない
+# (各シャードはコーパスの複製を持つため RAM が倍になる。明示した場合のみ有効)。
+FAISS_SHARD_ENV = "FAISS_SHARD_T"
+_SHARD_MIN_ROWS = 50_000
+
+
+def _shard_count() -> int:
+    raw = os.getenv(FAISS_SHARD_ENV)
+    if raw is None:
+        return 1
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        LOGGER.warning("invalid %s=%r; sharding disabled", FAISS_SHARD_ENV, raw)
+        return 1
 
 
 @dataclass
 class _BookInfo:
     book_id: str
     chunk_indices: list[int]
+    index: faiss.IndexHNSWFlat | None = None
 
 
 class MLXEmbeddingService:
@@ -75,19 +151,77 @@ class MLXEmbeddingService:
         os.makedirs(cache_dir, exist_ok=True)
         self.model_name = model_name or "mlx-community/multilingual-e5-small-mlx"
         self.index_path = os.path.join(cache_dir, "mlx_faiss.index")
-        self.meta_path = os.path.join(cache_dir, "mlx_chunks_metadata.pkl")
+        # チャンクメタデータは列指向 (book_id/chunk_id: npz, text: pickle) で保存
+        self.meta_path = os.path.join(cache_dir, "mlx_chunks_meta.npz")
+        self.text_path = os.path.join(cache_dir, "mlx_chunks_text.pkl")
+        self.legacy_meta_path = os.path.join(cache_dir, "mlx_chunks_metadata.pkl")
         self.info_path = os.path.join(cache_dir, "mlx_index_info.json")
+        self.book_index_dir = os.path.join(cache_dir, "mlx_book_index")
         self.index: faiss.Index | None = None
         self.embeddings: np.ndarray | None = None
+        # embeddings の実体。容量を倍々に確保し、embeddings はその先頭行のビュー
+        self._emb_buf: np.ndarray | None = None
+        # チャンクメタデータ (SoA): 同一インデックスが FAISS の行番号に対応。
+        # book_id/chunk_id は ndarray で持ち、検索結果をまとめて引く
         self.texts: list[str] = []
-        self.chunks_metadata: list[dict[str, Any]] = []
+        self._meta_book_id: np.ndarray = np.empty(0, dtype=object)
+        self._meta_chunk_id: np.ndarray = np.empty(0, dtype=np.int32)
         self._book_map: dict[str, _BookInfo] = {}
+        # 前回の save_index 以降に作られた書籍 HNSW (保存時はこれだけ書き出す)
+        self._dirty_books: set[str] = set()
+        self._on_gpu = False
+        # GPU 転送用の StandardGpuResources (初回転送時に確保)
+        self._gpu_res: Any | None = None
+        # (開始行, 部分インデックス) のリスト。add_book の追加行は末尾シャードへ
+        # 追記し、シャード数が変わったときだけ検索時に再構築する
+        self._shards: list[tuple[int, faiss.Index]] | None = None
+        # シャード再構築とプール生成は並行リクエスト間でロックして 1 回だけ行う。
+        # プールはサービスの寿命中 1 つを使い回す (差し替えると使用中の
+        # リクエストが shutdown 済みプールへ submit しうるため)
+        self._shard_lock = threading.Lock()
+        self._shard_pool: ThreadPoolExecutor | None = None
         self._model: Any | None = None
         self._tokenizer: Any | None = None
+        # メモリ上のインデックスが最新であれば再読込しない。別プロセス (Web アプリ
+        # と MCP サーバ等) が書き直した場合は index ファイルの mtime で検知する
+        self._loaded = False
+        self._index_mtime_ns: int | None = None
+        # 未保存の add_book がある間はディスクから読み直さない (追加分を失うため)
+        self._dirty = False
         self._dev_mode = bool(int(os.getenv("MLX_EMBEDDING_DEV", "1")))
         if not self._dev_mode:
             self._try_load_model()
 
+    @property
+    def chunks_metadata(self) -> list[dict[str, Any]]:
+        """後方互換用: チャンクごとの dict リストをその場で組み立てて返す。"""
+        return [
+            {"book_id": bid, "chunk_id": cid, "text": text}
+            for bid, cid, text in zip(
+                self._meta_book_id.tolist(),
+                self._meta_chunk_id.tolist(),
+                self.texts,
+                strict=True,
+            )
+        ]
+
+    def book_chunks(self, book_id: str) -> list[dict[str, Any]]:
+        """1 冊分のチャンク (chunk_id, text) を chunk_id 順で返す。
+
+        chunks_metadata と違い、対象書籍の行だけを列から引く。
+        """
+        book = self._book_map.get(book_id)
+        if book is None:
+            return []
+        idxs = np.asarray(book.chunk_indices, dtype=np.int64)
+        cids = self._meta_chunk_id[idxs].tolist()
+        chunks = [
+            {"chunk_id": cid, "text": self.texts[i]}
+            for i, cid in zip(idxs.tolist(), cids, strict=True)
+        ]
+        chunks.sort(key=lambda c: c["chunk_id"])
+        return chunks
+
     def _try_load_model(self) -> None:
         try:
             from mlx_lm import load as mlx_load  # type: ignore
@@ -99,12 +233,18 @@ class MLXEmbeddingService:
             raise RuntimeError(msg) from exc
 
     def save_index(self) -> None:  # noqa: D401
-        if self.index is None or self.embeddings is None:
+        cpu_index = self._cpu_index()
+        if cpu_index is None or self.embeddings is None:
             return
         try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.meta_path, "wb") as f:
-                pickle.dump(self.chunks_metadata, f)
+            faiss.write_index(cpu_index, self.index_path)
+            np.savez(
+                self.meta_path,
+                book_id=np.asarray(self._meta_book_id, dtype=str),
+                chunk_id=self._meta_chunk_id,
+            )
+            with open(self.text_path, "wb") as f:
+                pickle.dump(self.texts, f, protocol=5)
             info = {
                 "model_name": self.model_name,
                 "total_chunks": len(self.texts),
@@ -113,38 +253,146 @@ class MLXEmbeddingService:
             }
             with open(self.info_path, "w", encoding="utf-8") as f:
                 json.dump(info, f, ensure_ascii=False)
+            self._index_mtime_ns = os.stat(self.index_path).st_mtime_ns
+            self._dirty = False
+            os.makedirs(self.book_index_dir, exist_ok=True)
+            for bid in sorted(self._dirty_books):
+                book = self._book_map.get(bid)
+                if book is not None and book.index is not None:
+                    faiss.write_index(book.index, self._book_index_path(bid))
+            self._dirty_books.clear()
         except OSError as exc:  # noqa: BLE001
             LOGGER.warning("save_index failed: %s", exc)
 
+    def _move_index_to_gpu(self) -> bool:
+        if self.index is None or self._on_gpu or not _gpu_available():
+            return self._on_gpu
+        try:
+            if self._gpu_res is None:
+                self._gpu_res = faiss.StandardGpuResources()
+            self.index = _index_to_gpu(self.index, self._gpu_res)
+        except (AttributeError, RuntimeError) as exc:
+            LOGGER.warning("GPU offload unavailable, staying on CPU: %s", exc)
+            return False
+        self._on_gpu = True
+        return True
+
+    def _cpu_index(self) -> faiss.Index | None:
+        """保存用に CPU 上のコーパスインデックスを返す。GPU 時は埋め込みから再構築。"""
+        current = self.index
+        if current is None or not self._on_gpu or self.embeddings is None:
+            return current
+        index = _build_corpus_index(current.d)
+        index.add(self.embeddings.astype(np.float32))
+        return index
+
     # Optional helper to build index from all EPUBs in a directory
-    def build_index(self, epub_dir: str) -> None:  # noqa: D401
+    def build_index(self, epub_dir: str, *, gpu_bulk_add: bool = False) -> None:
+        """epub_dir 内の全 EPUB を追加し保存する。
+
+        gpu_bulk_add=True の場合は一括追加の間だけ GPU を使い、保存後に CPU へ戻す
+        (FAISS_GPU=1 で常時 GPU 運用している場合は戻さない)。
+        """
         try:
-            files = [f for f in os.listdir(epub_dir) if f.endswith(".epub")]
+            with os.scandir(epub_dir) as it:
+                entries = [e for e in it if e.name.endswith(".epub")]
         except OSError as exc:  # noqa: BLE001
             LOGGER.warning("build_index: failed to list dir %s: %s", epub_dir, exc)
             return
-        for fname in files:
-            bid = os.path.splitext(fname)[0]
-            full = os.path.join(epub_dir, fname)
+        self.load_index()
+        if gpu_bulk_add:
+            self._move_index_to_gpu()
+        for entry in entries:
+            bid = os.path.splitext(entry.name)[0]
             try:
-                self.add_book(bid, full)
+                self.add_book(bid, entry.path)
             except Exception as exc:  # noqa: BLE001
-                LOGGER.debug("build_index: skip %s: %s", fname, exc)
+                LOGGER.debug("build_index: skip %s: %s", entry.name, exc)
         self.save_index()
+        if gpu_bulk_add and self._on_gpu and not _gpu_enabled():
+            self.index = self._cpu_index()
+            self._on_gpu = False
+
+    def _index_file_mtime_ns(self) -> int | None:
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return None
 
     def load_index(self) -> bool:  # noqa: D401
-        if not (os.path.exists(self.index_path) and os.path.exists(self.meta_path)):
+        if self._loaded and (
+            self._dirty or self._index_file_mtime_ns() in (None, self._index_mtime_ns)
+        ):
+            return True
+        has_meta = os.path.exists(self.meta_path) and os.path.exists(self.text_path)
+        if not os.path.exists(self.index_path) or not (
+            has_meta or os.path.exists(self.legacy_meta_path)
+        ):
             return False
         try:
+            mtime_ns = self._index_file_mtime_ns()
             self.index = faiss.read_index(self.index_path)
-            with open(self.meta_path, "rb") as f:
-                self.chunks_metadata = pickle.load(f)
-            self.texts = [m["text"] for m in self.chunks_metadata]
+            self._on_gpu = False
+            self._shards = None
+            # 追記型 add のため、行番号を FAISS 側と揃えた埋め込みを復元しておく
+            self.embeddings = self.index.reconstruct_n(0, self.index.ntotal).astype(
+                np.float16
+            )
+            if has_meta:
+                self._load_metadata_columns()
+            else:
+                self._load_legacy_metadata()
+            self._restore_book_map()
+            if _gpu_enabled():
+                self._move_index_to_gpu()
+            self._loaded = True
+            self._index_mtime_ns = mtime_ns
             return True
         except Exception as exc:  # noqa: BLE001
             LOGGER.warning("load_index failed: %s", exc)
             return False
 
+    def _load_metadata_columns(self) -> None:
+        with np.load(self.meta_path) as cols:
+            self._meta_book_id = cols["book_id"].astype(object)
+            self._meta_chunk_id = cols["chunk_id"].astype(np.int32)
+        with open(self.text_path, "rb") as f:
+            self.texts = pickle.load(f)
+
+    def _load_legacy_metadata(self) -> None:
+        """旧形式 (list[dict] の単一 pickle) を列へ展開する。"""
+        with open(self.legacy_meta_path, "rb") as f:
+            rows: list[dict[str, Any]] = pickle.load(f)
+        self._meta_book_id = np.array([m["book_id"] for m in rows], dtype=object)
+        self._meta_chunk_id = np.array([m["chunk_id"] for m in rows], dtype=np.int32)
+        self.texts = [m["text"] for m in rows]
+
+    def _book_index_path(self, book_id: str) -> str:
+        return os.path.join(self.book_index_dir, f"{book_id}.index")
+
+    def _restore_book_map(self) -> None:
+        """book_id 列から書籍→チャンク対応を復元し、保存済み HNSW を読む。"""
+        self._book_map = {}
+        self._dirty_books = set()
+        for i, bid in enumerate(self._meta_book_id.tolist()):
+            if bid not in self._book_map:
+                self._book_map[bid] = _BookInfo(book_id=bid, chunk_indices=[])
+            self._book_map[bid].chunk_indices.append(i)
+        for bid, book in self._book_map.items():
+            path = self._book_index_path(bid)
+            if len(book.chunk_indices) < _HNSW_MIN_ROWS or not os.path.exists(path):
+                continue  # search 時に遅延構築
+            try:
+                index = faiss.read_index(path)
+            except RuntimeError as exc:
+                LOGGER.debug("book index load skipped %s: %s", bid, exc)
+                continue
+            # 種別や件数が合わない古いファイルは使わず search 時に作り直す
+            if isinstance(index, faiss.IndexHNSWFlat) and (
+                index.ntotal == len(book.chunk_indices)
+            ):
+                book.index = index
+
     def add_book(self, book_id: str, epub_path: str) -> None:  # noqa: D401
         self.load_index()
         dummy_txt = os.path.join(self.cache_dir, f"{book_id}.txt")
@@ -158,85 +406,219 @@ class MLXEmbeddingService:
             else:
                 raise exc
         chunks = _chunk_markdown(md)
-        new_vecs: list[np.ndarray] = []
-        dim = 1024
-        for i, ch in enumerate(chunks):
-            if self._dev_mode or self._model is None:
-                v = _hash_vec(f"{book_id}:{i}:{ch[:50]}", dim)
-            else:
-                raise RuntimeError("実モデル埋め込みパス未実装")
-            new_vecs.append(v)
-            self.chunks_metadata.append(
-                {"book_id": book_id, "chunk_id": i, "text": ch[:1000]}
-            )
-        mat = np.vstack(new_vecs).astype(np.float32)
-        self.texts.extend([c["text"] for c in self.chunks_metadata[-len(chunks) :]])
+        if not (self._dev_mode or self._model is None):
+            raise RuntimeError("実モデル埋め込みパス未実装")
+        keys = [f"{book_id}:{i}:{ch[:50]}" for i, ch in enumerate(chunks)]
+        # 新規ブロックのみベクトル化して追記する (既存コーパスの再構築はしない)
+        mat = _hash_to_matrix(keys, 1024)
+        self._meta_book_id = np.concatenate(
+            [self._meta_book_id, np.full(len(chunks), book_id, dtype=object)]
+        )
+        self._meta_chunk_id = np.concatenate(
+            [self._meta_chunk_id, np.arange(len(chunks), dtype=np.int32)]
+        )
+        self.texts.extend(ch[:1000] for ch in chunks)
         if self.index is None:
-            self.index = faiss.IndexFlatIP(mat.shape[1])
-        if self.embeddings is None:
-            self.embeddings = mat
-        else:
-            self.embeddings = np.vstack([self.embeddings, mat])
-        self.embeddings = _norm(self.embeddings)
-        self.index.reset()
-        self.index.add(self.embeddings)
-        start = len(self.embeddings) - mat.shape[0]
-        self._book_map[book_id] = _BookInfo(
+            self.index = _build_corpus_index(mat.shape[1])
+        # 保持用の埋め込みは fp16 (FAISS へは float32 で渡す)
+        self.embeddings = self._append_embeddings(mat)
+        self.index.add(mat)
+        with self._shard_lock:
+            if self._shards:
+                self._shards[-1][1].add(mat)
+        start = self.index.ntotal - mat.shape[0]
+        self._loaded = True
+        self._dirty = True
+        book = _BookInfo(
             book_id=book_id, chunk_indices=list(range(start, start + mat.shape[0]))
         )
+        if mat.shape[0] >= _HNSW_MIN_ROWS:
+            book.index = _build_book_index(mat)
+            self._dirty_books.add(book_id)
+        self._book_map[book_id] = book
+
+    def _append_embeddings(self, mat: np.ndarray) -> np.ndarray:
+        """fp16 バッファへ行を追記し、使用中の行のビューを返す。
+
+        冊ごとに全体を vstack し直すと取り込み全体で O(冊数 × 総行数) の
+        コピーになるため、容量不足時のみ倍の大きさで確保し直す。
+        """
+        cur = self.embeddings
+        n = 0 if cur is None else len(cur)
+        need = n + len(mat)
+        buf = self._emb_buf
+        if buf is None or cur is None or cur.base is not buf or len(buf) < need:
+            new_buf = np.empty((max(need, 2 * n), mat.shape[1]), dtype=np.float16)
+            if cur is not None:
+                new_buf[:n] = cur
+            buf = self._emb_buf = new_buf
+        buf[n:need] = mat
+        return buf[:need]
 
     def search(
         self, query: str, top_k: int = 5, book_id: str | None = None
     ) -> list[dict[str, Any]]:  # noqa: D401
+        return self.search_batch([query], top_k=top_k, book_id=book_id)[0]
+
+    def search_batch(
+        self, queries: list[str], top_k: int = 5, book_id: str | None = None
+    ) -> list[list[dict[str, Any]]]:
+        """複数クエリを (Nq, d) 行列 1 つにまとめ、1 回の FAISS 検索で引く。"""
         if self.index is None or self.embeddings is None:
+            return [[] for _ in queries]
+        if not queries:
             return []
-        vec = _hash_vec("__q__" + query, self.index.d).reshape(1, -1)
-        vec = vec / (np.linalg.norm(vec, axis=1, keepdims=True) + 1e-9)
+        return self._search_vecs(_query_vecs(queries, self.index.d), top_k, book_id)
+
+    def search_books(
+        self, query: str, book_ids: list[str], top_k: int = 5
+    ) -> dict[str, list[dict[str, Any]] | None]:
+        """1 つのクエリを複数書籍で検索する。クエリのベクトル化は 1 回だけ行う。
+
+        各書籍の結果は search(query, top_k, book_id) と同じ。検索に失敗した書籍
+        (壊れた HNSW 等) は None とし、他の書籍の結果には影響させない。
+        """
+        if self.index is None or self.embeddings is None:
+            return {b: [] for b in book_ids}
+        vecs = _query_vecs([query], self.index.d)
+        results: dict[str, list[dict[str, Any]] | None] = {}
+        for b in book_ids:
+            try:
+                results[b] = self._search_vecs(vecs, top_k, b)[0]
+            except (OSError, ValueError, RuntimeError) as exc:
+                LOGGER.warning("search_books: %s failed: %s", b, exc)
+                results[b] = None
+        return results
+
+    def _search_vecs(
+        self, vecs: np.ndarray, top_k: int, book_id: str | None
+    ) -> list[list[dict[str, Any]]]:
+        if self.index is None or self.embeddings is None:
+            return [[] for _ in range(len(vecs))]
         if book_id and book_id in self._book_map:
-            idxs = self._book_map[book_id].chunk_indices
-            sub_emb = self.embeddings[idxs]
-            tmp = faiss.IndexFlatIP(self.index.d)
-            tmp.add(sub_emb)
-            scores, sub_ids = tmp.search(vec, min(top_k, len(idxs)))
-            results: list[dict[str, Any]] = []
-            for rank, (sid, sc) in enumerate(
-                zip(sub_ids[0], scores[0], strict=False), start=1
-            ):
-                gidx = idxs[sid]
-                md = self.chunks_metadata[gidx]
-                results.append(
-                    {
-                        "rank": rank,
-                        "score": float(sc),
-                        "text": md["text"],
-                        "book_id": md["book_id"],
-                        "chunk_id": md["chunk_id"],
-                    }
+            book = self._book_map[book_id]
+            idxs = np.asarray(book.chunk_indices, dtype=np.int64)
+            if len(idxs) < _HNSW_MIN_ROWS:
+                return self._search_rows(self.embeddings, vecs, idxs, top_k)
+            if book.index is None:
+                book.index = _build_book_index(self.embeddings[idxs].astype(np.float32))
+                self._dirty_books.add(book_id)
+            book.index.hnsw.efSearch = max(_HNSW_EF_SEARCH, top_k)
+            scores, sub_ids = book.index.search(vecs, min(top_k, len(idxs)))
+            # HNSW は候補不足時に -1 を返すため除外
+            return [
+                self._project(idxs[row_ids[row_ids >= 0]], row_scores[row_ids >= 0])
+                for row_ids, row_scores in zip(sub_ids, scores, strict=True)
+            ]
+        k = min(top_k, len(self.texts))
+        sharded = self._get_shards()
+        if sharded is not None:
+            rows = self._search_shards(*sharded, vecs, k)
+        else:
+            scores, ids = self.index.search(vecs, k)
+            rows = list(zip(scores, ids, strict=True))
+        return [self._project(row_ids, row_scores) for row_scores, row_ids in rows]
+
+    def _search_rows(
+        self, embeddings: np.ndarray, vecs: np.ndarray, idxs: np.ndarray, top_k: int
+    ) -> list[list[dict[str, Any]]]:
+        """指定行だけを fp16 の保持分から内積で厳密に走査する (小さな書籍用)。"""
+        sub = embeddings[idxs].astype(np.float32)
+        # クエリごとに行列ベクトル積で求め、単発検索とバッチ検索で同じスコアにする
+        scores = np.stack([sub @ q for q in vecs])
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        return [
+            self._project(idxs[row], row_scores[row])
+            for row, row_scores in zip(order, scores, strict=True)
+        ]
+
+    def _get_shards(
+        self,
+    ) -> tuple[list[tuple[int, faiss.Index]], ThreadPoolExecutor] | None:
+        """行シャードと走査用プールを返す。シャード化しない場合は None。"""
+        embeddings = self.embeddings
+        if self._on_gpu or embeddings is None:
+            return None
+        n_shards = min(_shard_count(), len(embeddings))
+        if n_shards < 2 or len(embeddings) < _SHARD_MIN_ROWS:
+            return None
+        with self._shard_lock:
+            if self._shard_pool is None:
+                self._shard_pool = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or n_shards,
+                    thread_name_prefix="faiss-shard",
                 )
-            return results
-        scores, ids = self.index.search(vec, min(top_k, len(self.chunks_metadata)))
-        out: list[dict[str, Any]] = []
-        for rank, (i, sc) in enumerate(zip(ids[0], scores[0], strict=False), start=1):
-            md = self.chunks_metadata[i]
-            out.append(
-                {
-                    "rank": rank,
-                    "score": float(sc),
-                    "text": md["text"],
-                    "book_id": md["book_id"],
-                    "chunk_id": md["chunk_id"],
-                }
+            shards = self._shards
+            if shards is None or len(shards) != n_shards:
+                shards = []
+                start = 0
+                for part in np.array_split(embeddings, n_shards, axis=0):
+                    index = _build_corpus_index(part.shape[1])
+                    index.add(part.astype(np.float32))
+                    shards.append((start, index))
+                    start += part.shape[0]
+                self._shards = shards
+            return shards, self._shard_pool
+
+    @staticmethod
+    def _search_shards(
+        shards: list[tuple[int, faiss.Index]],
+        pool: ThreadPoolExecutor,
+        vecs: np.ndarray,
+        k: int,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """各シャードで top-k を取り、クエリ行ごとに全体の top-k にマージする。
+
+        FAISS は検索中 GIL を解放するため、シャードはスレッドで並列に走査する。
+        """
+        futures = [
+            pool.submit(index.search, vecs, min(k, index.ntotal)) for _, index in shards
+        ]
+        parts = [
+            (start, *fut.result())
+            for (start, _), fut in zip(shards, futures, strict=True)
+        ]
+        rows: list[tuple[np.ndarray, np.ndarray]] = []
+        for row in range(vecs.shape[0]):
+            valid = [ids[row] >= 0 for _, _, ids in parts]
+            merged_scores = np.concatenate(
+                [scores[row][v] for (_, scores, _), v in zip(parts, valid, strict=True)]
+            )
+            merged_ids = np.concatenate(
+                [
+                    ids[row][v] + start
+                    for (start, _, ids), v in zip(parts, valid, strict=True)
+                ]
+            )
+            order = np.argsort(-merged_scores, kind="stable")[:k]
+            rows.append((merged_scores[order], merged_ids[order]))
+        return rows
+
+    def _project(self, ids: np.ndarray, scores: np.ndarray) -> list[dict[str, Any]]:
+        """行番号の配列から列をまとめて引き、最後に一度だけ結果 dict を組み立てる。"""
+        bids = self._meta_book_id[ids].tolist()
+        cids = self._meta_chunk_id[ids].tolist()
+        return [
+            {
+                "rank": rank,
+                "score": sc,
+                "text": self.texts[i],
+                "book_id": bid,
+                "chunk_id": cid,
+            }
+            for rank, (i, sc, bid, cid) in enumerate(
+                zip(ids.tolist(), scores.tolist(), bids, cids, strict=True), start=1
             )
-        return out
+        ]
 
     def get_stats(self) -> dict[str, Any]:  # noqa: D401
         return {
             "model_name": self.model_name,
             "total_books": len(self._book_map),
-            "total_chunks": len(self.chunks_metadata),
+            "total_chunks": len(self.texts),
             "index_dimension": (self.index.d if self.index else 0),
             "books": {b: len(info.chunk_indices) for b, info in self._book_map.items()},
         }
 
 
-__all__ = ["MLXEmbeddingService"]
+__all__ = ["MLXEmbeddingService", "configure_faiss_threads"]
@@ -14,6 +14,8 @@ from typing import Any
 
 from fastapi import APIRouter
 
+from src.mlx_embedding_service import configure_faiss_threads
+
 
 class MLXFAISSIntegration:
     """Small helper to mount FAISS endpoints under the main app."""
@@ -60,6 +62,7 @@ class MLXFAISSIntegration:
 
     def initialize(self) -> None:
         """Best-effort index load on startup (non-fatal on failure)."""
+        configure_faiss_threads()
         try:
             self.embedding_service.load_index()
         except Exception as exc:  # noqa: BLE001
@@ -14,22 +14,76 @@ from __future__ import annotations
 import json
 import logging
 import os
+import time
 from collections.abc import Callable
 from dataclasses import dataclass
 from datetime import UTC, datetime
-from typing import Any, Literal
+from types import ModuleType
+from typing import Any, Literal, Protocol
 
 from src.epub_util import extract_epub_text
 
+# orjson is optional; stdlib json is used when missing
+orjson: ModuleType | None
+try:
+    import orjson as _orjson
+
+    orjson = _orjson
+except ModuleNotFoundError:  # pragma: no cover - fallback when orjson missing
+    orjson = None  # pylint: disable=invalid-name
+
 LOGGER = logging.getLogger(__name__)
 
 SearchResult = dict[str, Any]
+# (query, book_id, top_k, chunks_total)
+_CacheKey = tuple[str, str | None, int, int]
+# キャッシュ照合に使う total_chunks を再取得せず信用する秒数
+_CHUNKS_TOTAL_TTL_SEC = 60.0
 
 
 def _now_iso() -> str:
     return datetime.now(UTC).isoformat()
 
 
+def _dumps_line(obj: Any) -> bytes:
+    """JSONL 1 行分 (改行付き) の bytes を返す。"""
+    if orjson is not None:
+        line: bytes = orjson.dumps(obj)
+        return line + b"\n"
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _loads_line(line: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+# (epub_path, cache_dir) -> 生成済み md パス。肯定結果だけを覚える。md は削除や
+# キャッシュ掃除で消えうるため、ヒット時も存在を 1 回確かめ、無ければ捨てる
+_MD_PATH_CACHE: dict[tuple[str, str], str] = {}
+_MD_PATH_CACHE_MAX = 4096
+
+
+def _cached_md(epub_path: str, cache_dir: str) -> str | None:
+    """覚えている md パスがまだ存在すれば返し、消えていればエントリを捨てる。"""
+    key = (epub_path, cache_dir)
+    cached = _MD_PATH_CACHE.get(key)
+    if cached is None:
+        return None
+    if os.path.exists(cached):
+        return cached
+    _MD_PATH_CACHE.pop(key, None)
+    return None
+
+
+def _remember_md(epub_path: str, cache_dir: str, md_path: str) -> str:
+    if len(_MD_PATH_CACHE) >= _MD_PATH_CACHE_MAX:
+        _MD_PATH_CACHE.clear()
+    _MD_PATH_CACHE[(epub_path, cache_dir)] = md_path
+    return md_path
+
+
 def get_or_create_markdown(epub_path: str, cache_dir: str) -> str:
     """EPUB から Markdown を生成 (既に存在すれば再利用) しパスを返す。
 
@@ -37,11 +91,14 @@ def get_or_create_markdown(epub_path: str, cache_dir: str) -> str:
     戻り値: markdown ファイルパス
     失敗時: FileNotFoundError
     """
+    cached = _cached_md(epub_path, cache_dir)
+    if cached is not None:
+        return cached
     book_id = os.path.splitext(os.path.basename(epub_path))[0]
     txt_cache = os.path.join(cache_dir, f"{book_id}.txt")
     md_cache = os.path.join(cache_dir, f"{book_id}.md")
     if os.path.exists(md_cache):
-        return md_cache
+        return _remember_md(epub_path, cache_dir, md_cache)
     if not os.path.exists(epub_path):  # md 無く epub も無い
         raise FileNotFoundError(f"EPUB も Markdown も存在しません: {epub_path}")
     os.makedirs(cache_dir, exist_ok=True)
@@ -49,12 +106,15 @@ def get_or_create_markdown(epub_path: str, cache_dir: str) -> str:
     extract_epub_text(epub_path, txt_cache)
     if not os.path.exists(md_cache):  # 念のため
         raise FileNotFoundError(f"Markdown 生成失敗: {md_cache}")
-    return md_cache
+    return _remember_md(epub_path, cache_dir, md_cache)
 
 
-@dataclass
+@dataclass(slots=True)
 class SearchCacheEntry:
-    """検索結果キャッシュ 1 件分の保持構造。"""
+    """検索結果キャッシュ 1 件分の保持構造。
+
+    JSONL へはフィールド順の配列 1 行として保存する (to_row / from_row)。
+    """
 
     query: str
     book_id: str | None
@@ -63,69 +123,158 @@ class SearchCacheEntry:
     created_at: str
     chunks_total: int
 
+    def to_row(self) -> list[Any]:
+        return [
+            self.query,
+            self.book_id,
+            self.top_k,
+            self.results,
+            self.created_at,
+            self.chunks_total,
+        ]
+
+    @classmethod
+    def from_row(cls, row: Any) -> SearchCacheEntry:
+        """配列行 (現行) / dict 行 (旧形式) のどちらからも復元する。"""
+        if isinstance(row, list):
+            query, book_id, top_k, results, created_at, chunks_total = row
+        elif isinstance(row, dict):
+            query = row.get("query")
+            book_id = row.get("book_id")
+            top_k = row.get("top_k", 0)
+            results = row.get("results", [])
+            created_at = row.get("created_at", "")
+            chunks_total = row.get("chunks_total", 0)
+        else:
+            raise TypeError("cache entry must be an array or object")
+        return cls(
+            query=str(query),
+            book_id=book_id,
+            top_k=int(top_k),
+            results=results,
+            created_at=str(created_at),
+            chunks_total=int(chunks_total),
+        )
+
+
+class EmbeddingService(Protocol):
+    """RAGPipeline が使う MLXEmbeddingService 互換のインタフェース。"""
+
+    def load_index(self) -> bool: ...
+
+    def save_index(self) -> None: ...
+
+    def add_book(self, book_id: str, epub_path: str) -> None: ...
+
+    def get_stats(self) -> dict[str, Any]: ...
+
+    def search(
+        self, query: str, top_k: int, book_id: str | None
+    ) -> list[SearchResult]: ...
+
 
 class RAGPipeline:
     """簡易 RAG パイプライン。
 
-    埋め込みサービスは MLXEmbeddingService 互換 (add_book, search, save_index,
-    load_index, get_stats) の任意オブジェクトを受け入れる。
+    埋め込みサービスは MLXEmbeddingService 互換 (EmbeddingService) の任意
+    オブジェクトを受け入れる。
     """
 
     def __init__(
         self,
         cache_dir: str,
         epub_dir: str,
-        embedding_service: Any | None = None,
+        embedding_service: EmbeddingService | None = None,
         model_loader: Callable[[], Any] | None = None,
     ) -> None:
         self.cache_dir = cache_dir
         self.epub_dir = epub_dir
         os.makedirs(cache_dir, exist_ok=True)
-        # 遅延 import (モデルロード回避のため)
-        if embedding_service is None:
-            from src.mlx_embedding_service import MLXEmbeddingService
-
-            embedding_service = MLXEmbeddingService(cache_dir)
-        self.embedding_service = embedding_service
-        self._search_cache_path = os.path.join(cache_dir, "faiss_search_cache.json")
+        # 未指定時は初回アクセスまで import/生成を遅らせる (キャッシュのみの利用では不要)
+        self._embedding_service: EmbeddingService | None = embedding_service
+        # 追記型 JSONL (1 行 1 エントリ)。旧形式 .json は初回読込時に移行する
+        self._search_cache_path = os.path.join(cache_dir, "faiss_search_cache.jsonl")
+        self._legacy_search_cache_path = os.path.join(
+            cache_dir, "faiss_search_cache.json"
+        )
+        # 永続化順序はリスト、照合はキー辞書で O(1)
         self._search_cache: list[SearchCacheEntry] = []
+        self._search_index: dict[_CacheKey, SearchCacheEntry] = {}
         self._cache_loaded = False
+        self._chunks_total_cache: int | None = None
+        self._chunks_total_ts = 0.0
         self._model_loader = model_loader  # 将来拡張用
 
+    @property
+    def embedding_service(self) -> EmbeddingService:
+        """埋め込みサービス。未指定なら初回アクセス時に MLXEmbeddingService を生成。"""
+        if self._embedding_service is None:
+            from src.mlx_embedding_service import MLXEmbeddingService
+
+            self._embedding_service = MLXEmbeddingService(self.cache_dir)
+        return self._embedding_service
+
     # --------- 内部ユーティリティ ---------
     def _load_search_cache(self) -> None:
         if self._cache_loaded:
             return
+        self._cache_loaded = True
         if os.path.exists(self._search_cache_path):
+            self._load_search_cache_lines()
+        elif os.path.exists(self._legacy_search_cache_path):
             try:
-                with open(self._search_cache_path, encoding="utf-8") as f:
+                with open(self._legacy_search_cache_path, encoding="utf-8") as f:
                     raw = json.load(f)
                 entries = raw.get("entries", []) if isinstance(raw, dict) else []
                 for e in entries:
-                    if not isinstance(e, dict):
-                        continue
-                    self._search_cache.append(
-                        SearchCacheEntry(
-                            query=str(e.get("query")),
-                            book_id=e.get("book_id"),
-                            top_k=int(e.get("top_k", 0)),
-                            results=e.get("results", []),
-                            created_at=str(e.get("created_at", "")),
-                            chunks_total=int(e.get("chunks_total", 0)),
-                        )
-                    )
+                    if isinstance(e, dict):
+                        self._add_entry(SearchCacheEntry.from_row(e))
             except (OSError, ValueError, TypeError) as exc:
                 LOGGER.warning("検索キャッシュ読込失敗: %s", exc)
-        self._cache_loaded = True
+            if self._search_cache:
+                self._save_search_cache()
+
+    def _load_search_cache_lines(self) -> None:
+        broken = 0
+        try:
+            with open(self._search_cache_path, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        self._add_entry(SearchCacheEntry.from_row(_loads_line(line)))
+                    except (ValueError, TypeError):
+                        broken += 1  # 書込中断などで壊れた行
+        except OSError as exc:
+            LOGGER.warning("検索キャッシュ読込失敗: %s", exc)
+            return
+        # 壊れた行・重複行があれば書き直して詰める
+        if broken or len(self._search_index) != len(self._search_cache):
+            LOGGER.info("検索キャッシュを圧縮: broken=%d", broken)
+            self._search_cache = list(self._search_index.values())
+            self._save_search_cache()
+
+    def _add_entry(self, entry: SearchCacheEntry) -> None:
+        self._search_cache.append(entry)
+        key = (entry.query, entry.book_id, entry.top_k, entry.chunks_total)
+        # 重複キーは先勝ち (従来の線形走査と同じ結果)
+        self._search_index.setdefault(key, entry)
 
     def _save_search_cache(self) -> None:
+        """全エントリで JSONL を書き直す (移行・圧縮時のみ)。"""
+        tmp_path = self._search_cache_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for e in self._search_cache:
+                    f.write(_dumps_line(e.to_row()))
+            os.replace(tmp_path, self._search_cache_path)
+        except (OSError, ValueError, TypeError) as exc:
+            LOGGER.warning("検索キャッシュ保存失敗: %s", exc)
+
+    def _append_search_cache(self, entry: SearchCacheEntry) -> None:
         try:
-            data = {
-                "updated_at": _now_iso(),
-                "entries": [e.__dict__ for e in self._search_cache],
-            }
-            with open(self._search_cache_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False)
+            with open(self._search_cache_path, "ab") as f:
+                f.write(_dumps_line(entry.to_row()))
         except (OSError, ValueError, TypeError) as exc:
             LOGGER.warning("検索キャッシュ保存失敗: %s", exc)
 
@@ -133,15 +282,8 @@ class RAGPipeline:
         self, query: str, book_id: str | None, top_k: int, chunks_total: int
     ) -> list[SearchResult] | None:
         self._load_search_cache()
-        for entry in self._search_cache:
-            if (
-                entry.query == query
-                and entry.book_id == book_id
-                and entry.top_k == top_k
-                and entry.chunks_total == chunks_total
-            ):
-                return entry.results
-        return None
+        entry = self._search_index.get((query, book_id, top_k, chunks_total))
+        return entry.results if entry is not None else None
 
     def _store_cache(
         self,
@@ -154,17 +296,16 @@ class RAGPipeline:
         # 既存重複は追加しない
         if self._match_cache(query, book_id, top_k, chunks_total) is not None:
             return
-        self._search_cache.append(
-            SearchCacheEntry(
-                query=query,
-                book_id=book_id,
-                top_k=top_k,
-                results=results,
-                created_at=_now_iso(),
-                chunks_total=chunks_total,
-            )
+        entry = SearchCacheEntry(
+            query=query,
+            book_id=book_id,
+            top_k=top_k,
+            results=results,
+            created_at=_now_iso(),
+            chunks_total=chunks_total,
         )
-        self._save_search_cache()
+        self._add_entry(entry)
+        self._append_search_cache(entry)
 
     # --------- 公開 API ---------
     def ensure_index(self) -> None:
@@ -172,12 +313,13 @@ class RAGPipeline:
         if self.embedding_service.load_index():
             return
         # 無い場合は EPUB から構築
-        epub_files = [f for f in os.listdir(self.epub_dir) if f.endswith(".epub")]
-        for epub_file in epub_files:
-            book_id = epub_file[:-5]
-            full = os.path.join(self.epub_dir, epub_file)
+        # scandir の DirEntry は種別情報を持つため追加の stat/パス結合が不要
+        with os.scandir(self.epub_dir) as it:
+            epub_entries = [e for e in it if e.name.endswith(".epub") and e.is_file()]
+        for entry in epub_entries:
+            book_id = entry.name[:-5]
             try:
-                self.embedding_service.add_book(book_id, full)
+                self.embedding_service.add_book(book_id, entry.path)
             except FileNotFoundError:
                 continue
         try:
@@ -193,11 +335,13 @@ class RAGPipeline:
         """
         epub_path = os.path.join(self.epub_dir, f"{book_id}.epub")
         md_path = os.path.join(self.cache_dir, f"{book_id}.md")
-        if not os.path.exists(epub_path) and not os.path.exists(md_path):
+        known = _cached_md(epub_path, self.cache_dir) is not None
+        if not known and not os.path.exists(epub_path) and not os.path.exists(md_path):
             raise FileNotFoundError(
                 f"EPUB / Markdown が存在しません: {book_id} (期待: {epub_path} or {md_path})"
             )
         self.embedding_service.add_book(book_id, epub_path)
+        self._chunks_total_cache = None  # チャンク数が変わるため再取得させる
         try:
             self.embedding_service.save_index()
         except (OSError, ValueError, RuntimeError) as exc:
@@ -218,12 +362,24 @@ class RAGPipeline:
             refresh : 毎回再検索しキャッシュ更新
             ignore  : キャッシュ読み書き無し
         """
+        prefer_cache = use_cache and cache_policy == "prefer"
+        # 直近に確認したチャンク数で先にキャッシュを引く (ヒット時はインデックス不要)
+        if (
+            prefer_cache
+            and self._chunks_total_cache is not None
+            and time.monotonic() - self._chunks_total_ts < _CHUNKS_TOTAL_TTL_SEC
+        ):
+            cached = self._match_cache(query, book_id, top_k, self._chunks_total_cache)
+            if cached is not None:
+                return cached
         self.ensure_index()
         stats = self.embedding_service.get_stats()
         chunks_total = (
             int(stats.get("total_chunks", 0)) if isinstance(stats, dict) else 0
         )
-        if use_cache and cache_policy == "prefer":
+        self._chunks_total_cache = chunks_total
+        self._chunks_total_ts = time.monotonic()
+        if prefer_cache:
             cached = self._match_cache(query, book_id, top_k, chunks_total)
             if cached is not None:
                 return cached
@@ -8,7 +8,20 @@ from typing import Any
 
 from src.common_util import get_book_list
 from src.epub_util import extract_epub_metadata
-from src.mlx_embedding_service import MLXEmbeddingService
+from src.mlx_embedding_service import MLXEmbeddingService, configure_faiss_threads
+
+# Keys that mark a status entry (not a search hit) in result lists
+_STATUS_KEYS = frozenset(("error", "message"))
+
+
+def _with_book_title(result: dict[str, Any], titles: dict[str, str]) -> dict[str, Any]:
+    """Attach book_title and convert book_id to the .epub filename (in place)."""
+    book_key = result.get("book_id")
+    result["book_title"] = (
+        titles.get(book_key, "Unknown") if isinstance(book_key, str) else "Unknown"
+    )
+    result["book_id"] = f"{book_key}.epub" if book_key else None
+    return result
 
 
 class SimpleEPUBService:
@@ -29,9 +42,13 @@ class SimpleEPUBService:
                 raise RuntimeError(
                     "app_config.yaml の mlx.embedding_model が未設定です。必ずモデルIDを設定してください。"
                 )
+        # app / MCP サーバのどちらから生成されても FAISS スレッド数を揃える
+        configure_faiss_threads()
         self.embedding_service = MLXEmbeddingService(
             cache_dir, model_name=embedding_model
         )
+        # (epub_dir の mtime_ns, book_id -> title)。書籍の追加・削除で mtime が変わる
+        self._titles_cache: tuple[int, dict[str, str]] | None = None
 
     def ensure_index_loaded(self) -> None:
         """Ensure MLX-FAISS index is available; build if missing."""
@@ -60,6 +77,22 @@ class SimpleEPUBService:
         """Get list of available EPUB books."""
         return get_book_list(self.epub_dir)
 
+    def _book_titles(self) -> dict[str, str]:
+        """Map book ids (without .epub) to titles, cached until epub_dir changes.
+
+        get_bookshelf parses every EPUB (metadata, TOC, cover), so rebuilding the
+        map on every search is far more expensive than the search itself.
+        """
+        mtime = os.stat(self.epub_dir).st_mtime_ns
+        if self._titles_cache is not None and self._titles_cache[0] == mtime:
+            return self._titles_cache[1]
+        titles = {
+            book["id"].replace(".epub", ""): book.get("title", "Unknown")
+            for book in self.get_bookshelf()
+        }
+        self._titles_cache = (mtime, titles)
+        return titles
+
     def get_book_metadata(self, book_id: str) -> dict[str, Any]:
         """Get metadata for a specific book."""
         epub_path = os.path.join(self.epub_dir, book_id)
@@ -90,7 +123,7 @@ class SimpleEPUBService:
 
             # Ensure book_id (filename) is present on results
             for result in results:
-                if "error" not in result and "message" not in result:
+                if _STATUS_KEYS.isdisjoint(result):
                     result["book_id"] = book_id
 
             return results
@@ -120,21 +153,14 @@ class SimpleEPUBService:
             results = self.embedding_service.search(query=query, top_k=top_k)
 
             # Add book title information
-            books = self.get_bookshelf()
-            book_titles = {
-                book["id"].replace(".epub", ""): book.get("title", "Unknown")
-                for book in books
-            }
-
-            # Enhance results with book titles
-            enhanced_results: list[dict[str, Any]] = []
-            for result in results:
-                if "error" not in result and "message" not in result:
-                    book_key = result.get("book_id")
-                    # Convert internal book_id to filename for UI consistency
-                    result["book_title"] = book_titles.get(book_key, "Unknown")
-                    result["book_id"] = f"{book_key}.epub" if book_key else None
-                    enhanced_results.append(result)
+            book_titles = self._book_titles()
+
+            # Enhance results with book titles (result dicts are ours to mutate)
+            enhanced_results = [
+                _with_book_title(result, book_titles)
+                for result in results
+                if _STATUS_KEYS.isdisjoint(result)
+            ]
 
             self.logger.debug("MLX全書籍検索完了: %d件の結果", len(enhanced_results))
 
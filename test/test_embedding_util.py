@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import os
-import tempfile
 
 import numpy as np
 
@@ -23,7 +22,7 @@ def test_create_embeddings_dev_mode_shape_and_determinism() -> None:
     assert emb.shape[1] == 1024
 
 
-def test_build_index_and_search_dev_mode() -> None:
+def test_build_index_and_search_dev_mode(tmp_path) -> None:
     texts = ["python basics", "fastapi guide", "faiss search"]
     emb = create_embeddings_from_texts(texts, model=None, tokenizer=None)
     # Build index just to ensure it doesn't raise; search path loads from disk
@@ -31,7 +30,7 @@ def test_build_index_and_search_dev_mode() -> None:
     pair = ModelPair(model=None, tokenizer=None)
     results = load_and_search(
         query="python",
-        base_path=_save_temp_embeddings(emb, texts),
+        base_path=_save_temp_embeddings(emb, texts, str(tmp_path)),
         model_pair=pair,
         top_k=2,
     )
@@ -50,8 +49,7 @@ def test_create_context_from_query_dev_mode() -> None:
     assert "------" in ctx
 
 
-def _save_temp_embeddings(emb: np.ndarray, texts: list[str]) -> str:
-    tmpdir = tempfile.mkdtemp(prefix="emb-util-")
+def _save_temp_embeddings(emb: np.ndarray, texts: list[str], tmpdir: str) -> str:
     base = os.path.join(tmpdir, "embs")
     save_embeddings(emb, texts, base)
     return base
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
 import os
-import tempfile
 from dataclasses import dataclass
 from types import SimpleNamespace
 
+import faiss
 import numpy as np
 import pytest
 
@@ -12,13 +12,24 @@ from src.embedding_util import (
     ModelPair,
     build_faiss_index,
     create_context_from_query,
+    create_embeddings_from_texts,
+    embed_query,
     embed_texts_and_save,
+    load_and_search,
     load_embeddings,
+    load_faiss_index,
     save_embeddings,
     search_similar,
+    search_similar_batch,
+    search_similar_with_vector,
 )
 
 
+def _rand(*shape: int, seed: int = 0) -> np.ndarray:
+    """Seeded float32 test vectors, so failures reproduce run to run."""
+    return np.random.default_rng(seed).random(shape, dtype=np.float32)
+
+
 def test_build_faiss_index_reshapes_1d_vector() -> None:
     vec = np.array([1.0, 2.0, 3.0, 4.0], dtype=np.float32)
     index = build_faiss_index(vec)
@@ -31,11 +42,10 @@ def test_build_faiss_index_invalid_dimension_raises() -> None:
         build_faiss_index(bad)
 
 
-def test_save_and_load_embeddings_roundtrip() -> None:
+def test_save_and_load_embeddings_roundtrip(tmp_path) -> None:
     texts = ["t1", "t2", "t3"]
-    emb = np.random.random((3, 8)).astype(np.float32)
-    tmpdir = tempfile.mkdtemp(prefix="emb-roundtrip-")
-    base = os.path.join(tmpdir, "embs")
+    emb = _rand(3, 8)
+    base = str(tmp_path / "embs")
     save_embeddings(emb, texts, base)
     loaded_emb, loaded_texts = load_embeddings(base)
     assert loaded_texts == texts
@@ -43,10 +53,21 @@ def test_save_and_load_embeddings_roundtrip() -> None:
     assert np.allclose(loaded_emb, emb)
 
 
-def test_embed_texts_and_save_files_created() -> None:
+def test_resave_loaded_embeddings_to_same_path(tmp_path) -> None:
+    base = str(tmp_path / "embs")
+    save_embeddings(_rand(200, 8), [f"t{i}" for i in range(200)], base)
+    emb, texts = load_embeddings(base)
+    save_embeddings(emb, texts, base)
+    # 保存前の mmap も読める (置き換え前の内容のまま)
+    assert np.array_equal(emb, _rand(200, 8))
+    reloaded, _ = load_embeddings(base)
+    assert np.array_equal(reloaded, emb)
+    assert sorted(os.listdir(tmp_path)) == ["embs.json", "embs.npy"]
+
+
+def test_embed_texts_and_save_files_created(tmp_path) -> None:
     texts = ["alpha", "beta"]
-    tmpdir = tempfile.mkdtemp(prefix="emb-save-")
-    base = os.path.join(tmpdir, "embs")
+    base = str(tmp_path / "embs")
     embed_texts_and_save(texts, base, model=None, tokenizer=None)
     assert os.path.exists(base + ".npy")
     assert os.path.exists(base + ".json")
@@ -57,7 +78,7 @@ def test_embed_texts_and_save_files_created() -> None:
 
 def test_create_context_from_query_custom_delimiter() -> None:
     texts = ["one", "two", "three"]
-    emb = np.random.random((3, 16)).astype(np.float32)
+    emb = _rand(3, 16)
     index = build_faiss_index(emb)
     pair = ModelPair(model=None, tokenizer=None)
     delim = "\n***\n"
@@ -68,7 +89,7 @@ def test_create_context_from_query_custom_delimiter() -> None:
 
 
 def test_search_similar_dimension_mismatch_raises() -> None:
-    emb = np.random.random((5, 4)).astype(np.float32)
+    emb = _rand(5, 4)
     index = build_faiss_index(emb)
     texts = [f"t{i}" for i in range(5)]
 
@@ -80,9 +101,7 @@ def test_search_similar_dimension_mismatch_raises() -> None:
 
     class DummyModel:
         def __call__(self, input_ids, attention_mask):
-            return SimpleNamespace(
-                text_embeds=np.random.random((1, 3)).astype(np.float32)
-            )
+            return SimpleNamespace(text_embeds=_rand(1, 3))
 
     pair = ModelPair(model=DummyModel(), tokenizer=DummyTokenizer())
     with pytest.raises(ValueError):
@@ -95,14 +114,12 @@ class _DummyModelLastHidden:
 
     def __call__(self, input_ids, attention_mask):
         b, seq_len = input_ids.shape
-        return SimpleNamespace(
-            last_hidden_state=np.random.random((b, seq_len, self.dim))
-        )
+        return SimpleNamespace(last_hidden_state=_rand(b, seq_len, self.dim))
 
 
 def test_search_similar_last_hidden_state_path() -> None:
     texts = ["aa", "bb", "cc"]
-    emb = np.random.random((3, 6)).astype(np.float32)
+    emb = _rand(3, 6)
     index = build_faiss_index(emb)
 
     class DummyTokenizer2:
@@ -116,3 +133,204 @@ def test_search_similar_last_hidden_state_path() -> None:
     results = search_similar("query", pair, index, texts, top_k=2)
     assert len(results) == 2
     assert all(r[2] in texts for r in results)
+
+
+def test_search_similar_batch_pads_ragged_queries() -> None:
+    texts = ["aa", "bb", "cc"]
+    index = build_faiss_index(_rand(3, 6))
+
+    class PaddingTokenizer:
+        def batch_encode_plus(self, batch, padding=False, truncation=False):
+            assert truncation
+            ids = [[1] * len(q) for q in batch]
+            if padding:
+                width = max(map(len, ids))
+                mask = [[1] * len(r) + [0] * (width - len(r)) for r in ids]
+                ids = [r + [0] * (width - len(r)) for r in ids]
+                return {"input_ids": np.array(ids), "attention_mask": np.array(mask)}
+            return {"input_ids": ids, "attention_mask": None}
+
+    pair = ModelPair(model=_DummyModelLastHidden(dim=6), tokenizer=PaddingTokenizer())
+    results = search_similar_batch(["q", "longer query"], pair, index, texts)
+    assert [len(r) for r in results] == [3, 3]
+
+
+def test_search_similar_batch_matches_single_queries() -> None:
+    texts = ["python basics", "fastapi guide", "faiss search", "epub reader"]
+    emb = _rand(4, 1024)
+    index = build_faiss_index(emb)
+    pair = ModelPair(model=None, tokenizer=None)
+    queries = ["python", "faiss", "epub"]
+    batched = search_similar_batch(queries, pair, index, texts, top_k=2)
+    assert len(batched) == len(queries)
+    for query, hits in zip(queries, batched, strict=True):
+        assert hits == search_similar(query, pair, index, texts, top_k=2)
+
+
+def test_load_embeddings_is_memory_mapped(tmp_path) -> None:
+    emb = _rand(2, 4)
+    base = str(tmp_path / "embs")
+    save_embeddings(emb, ["a", "b"], base)
+    loaded, _ = load_embeddings(base)
+    assert isinstance(loaded, np.memmap)
+    assert build_faiss_index(loaded).ntotal == 2
+
+
+def test_save_embeddings_float16_halves_file(tmp_path) -> None:
+    emb = _rand(4, 64)
+    base = str(tmp_path / "embs")
+    save_embeddings(emb, ["a", "b", "c", "d"], base, dtype="float16")
+    assert np.load(base + ".npy", mmap_mode="r").dtype == np.float16
+    loaded, texts = load_embeddings(base)
+    assert loaded.dtype == np.float32 and texts == ["a", "b", "c", "d"]
+    assert np.allclose(loaded, emb, atol=1e-3)
+
+
+def test_build_faiss_index_sq8_via_env(monkeypatch) -> None:
+    monkeypatch.setenv("RAG_INDEX_TYPE", "sq8")
+    texts = ["one", "two", "three", "four"]
+    emb = _rand(4, 16)
+    index = build_faiss_index(emb)
+    assert isinstance(index, faiss.IndexScalarQuantizer)
+    assert index.ntotal == 4
+    pair = ModelPair(model=None, tokenizer=None)
+    hits = search_similar("q", pair, index, texts, top_k=2)
+    assert len(hits) == 2
+
+
+def test_build_faiss_index_ivfpq_via_env(monkeypatch) -> None:
+    monkeypatch.setenv("RAG_INDEX_TYPE", "ivfpq")
+    # 学習件数が足りない小規模コーパスは flat のまま
+    small = build_faiss_index(_rand(8, 64))
+    assert isinstance(small, faiss.IndexFlatIP)
+
+    # 本番設定の学習は重いため、テストでは小さい符号表で同じ経路を通す
+    monkeypatch.setattr("src.embedding_util._IVFPQ_FACTORY", "IVF4,PQ4x4")
+    monkeypatch.setattr("src.embedding_util._IVFPQ_MIN_TRAIN", 16 * 39)
+    rng = np.random.default_rng(0)
+    emb = rng.standard_normal((16 * 39, 64)).astype(np.float32)
+    index = build_faiss_index(emb)
+    assert isinstance(index, faiss.IndexIVFPQ)
+    assert index.ntotal == emb.shape[0] and index.nprobe > 1
+    texts = [f"t{i}" for i in range(emb.shape[0])]
+    pair = ModelPair(model=None, tokenizer=None)
+    assert len(search_similar("q", pair, index, texts, top_k=3)) == 3
+
+
+def test_build_faiss_index_ivfpq_falls_back_for_indivisible_dim(monkeypatch) -> None:
+    import src.embedding_util as eu
+
+    monkeypatch.setenv("RAG_INDEX_TYPE", "ivfpq")
+    # 学習件数は足りていても、次元が PQ のサブ量子化器数で割り切れなければ flat
+    dim = eu._IVFPQ_PQ_M * 4 + 8
+    rng = np.random.default_rng(0)
+    emb = rng.standard_normal((eu._IVFPQ_MIN_TRAIN, dim)).astype(np.float32)
+    index = build_faiss_index(emb)
+    assert isinstance(index, faiss.IndexFlatIP)
+    assert index.ntotal == emb.shape[0]
+
+
+def test_load_and_search_uses_persisted_mmap_index(tmp_path, monkeypatch) -> None:
+    texts = ["python basics", "fastapi guide", "faiss search"]
+    base = str(tmp_path / "embs")
+    embed_texts_and_save(texts, base, model=None, tokenizer=None, with_index=True)
+    index = load_faiss_index(base)
+    assert index is not None and index.ntotal == len(texts)
+
+    def no_build(_emb):  # type: ignore[no-untyped-def]
+        raise AssertionError("index should not be rebuilt")
+
+    monkeypatch.setattr("src.embedding_util.build_faiss_index", no_build)
+    pair = ModelPair(model=None, tokenizer=None)
+    assert len(load_and_search("faiss", base, pair, top_k=2)) == 2
+
+    # 埋め込みを保存し直すと古い .faiss は破棄される
+    save_embeddings(_rand(1, 4), ["x"], base)
+    assert load_faiss_index(base) is None
+
+
+def test_build_faiss_index_fp16_matches_flat(monkeypatch) -> None:
+    emb = np.random.default_rng(1).random((32, 16)).astype(np.float32)
+    pair = ModelPair(model=None, tokenizer=None)
+    texts = [f"t{i}" for i in range(32)]
+    flat_hits = search_similar("q", pair, build_faiss_index(emb), texts, top_k=3)
+    monkeypatch.setenv("RAG_INDEX_TYPE", "fp16")
+    index = build_faiss_index(emb)
+    assert isinstance(index, faiss.IndexScalarQuantizer)
+    hits = search_similar("q", pair, index, texts, top_k=3)
+    assert [h[2] for h in hits] == [h[2] for h in flat_hits]
+
+
+def test_search_similar_with_vector_matches_query_search() -> None:
+    texts = ["python basics", "fastapi guide", "faiss search"]
+    pair = ModelPair(model=None, tokenizer=None)
+    indexes = [build_faiss_index(_rand(3, 1024, seed=seed)) for seed in range(2)]
+    qvec = embed_query("faiss", pair, 1024)
+    for index in indexes:
+        expected = search_similar("faiss", pair, index, texts, top_k=2)
+        assert search_similar_with_vector(qvec, index, texts, top_k=2) == expected
+    with pytest.raises(ValueError):
+        search_similar_with_vector(qvec[:8], indexes[0], texts)
+
+
+def test_dev_embeddings_are_per_text_deterministic() -> None:
+    texts = ["alpha", "beta", "gamma"]
+    batch = create_embeddings_from_texts(texts, model=None, tokenizer=None)
+    singles = [create_embeddings_from_texts([t], None, None)[0] for t in texts]
+    assert batch.dtype == np.float32 and batch.flags.c_contiguous
+    assert np.array_equal(batch, np.vstack(singles))
+    assert np.allclose(np.linalg.norm(batch, axis=1), 1.0, atol=1e-5)
+
+
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_texts_sidecar_is_plain_utf8_json(tmp_path, monkeypatch, backend) -> None:
+    import json
+
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr("src.embedding_util.orjson", None)
+    texts = ["日本語", 'quote " and \\ slash']
+    base = str(tmp_path / "embs")
+    save_embeddings(np.zeros((2, 4), dtype=np.float32), texts, base)
+    with open(base + ".json", encoding="utf-8") as f:
+        raw = f.read()
+    assert "日本語" in raw and json.loads(raw) == texts
+    assert load_embeddings(base)[1] == texts
+
+
+def test_embed_texts_and_save_skips_unchanged_inputs(tmp_path, monkeypatch) -> None:
+    import src.embedding_util as eu
+
+    base = str(tmp_path / "embs")
+    first = embed_texts_and_save(["a", "b"], base, model=None, tokenizer=None)
+    calls: list[int] = []
+    real = eu.create_embeddings_from_texts
+
+    def counting(texts, model, tokenizer):  # type: ignore[no-untyped-def]
+        calls.append(len(texts))
+        return real(texts, model, tokenizer)
+
+    monkeypatch.setattr(eu, "create_embeddings_from_texts", counting)
+    again = embed_texts_and_save(["a", "b"], base, None, None, with_index=True)
+    assert calls == [] and np.array_equal(again, first)
+    assert not isinstance(again, np.memmap) and again.flags.writeable
+    assert load_faiss_index(base) is not None
+    embed_texts_and_save(["b", "a"], base, model=None, tokenizer=None)
+    assert calls == [2]
+    assert load_embeddings(base)[1] == ["b", "a"]
+
+
+def test_embed_texts_and_save_rebuilds_index_when_type_changes(
+    tmp_path, monkeypatch
+) -> None:
+    base = str(tmp_path / "embs")
+    texts = ["a", "b", "c"]
+    monkeypatch.setenv("RAG_INDEX_TYPE", "flat")
+    embed_texts_and_save(texts, base, None, None, with_index=True)
+    assert isinstance(load_faiss_index(base), faiss.IndexFlatIP)
+
+    # 埋め込みは再利用しつつ、種別が変わった .faiss だけ作り直す
+    monkeypatch.setenv("RAG_INDEX_TYPE", "fp16")
+    embed_texts_and_save(texts, base, None, None, with_index=True)
+    assert isinstance(load_faiss_index(base), faiss.IndexScalarQuantizer)
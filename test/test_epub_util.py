@@ -4,6 +4,8 @@ import os
 import tempfile
 from unittest.mock import MagicMock, patch
 
+import pytest
+
 from src.epub_util import (
     extract_and_save_cover,
     extract_epub_metadata,
@@ -61,8 +63,27 @@ class TestEpubUtil:
                 assert "Content" in result
                 assert os.path.exists(cache_path + ".md")
 
-    def test_extract_epub_text_with_image(self):
+    def test_extract_epub_text_parses_archive_once(self):
+        """Metadata for a fresh extraction reuses the already parsed book."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            epub_path = os.path.join(temp_dir, "once.epub")
+            with open(epub_path, "w", encoding="utf-8") as f:
+                f.write("v1")
+
+            mock_book = MagicMock()
+            mock_book.get_items.return_value = []
+            mock_book.get_metadata.return_value = [("Once", {})]
+            with patch("src.epub_util.epub.read_epub", return_value=mock_book) as read:
+                result = extract_epub_text(epub_path, epub_path + ".txt")
+                assert extract_epub_metadata(epub_path)["title"] == "Once"
+
+            assert "# Once" in result
+            assert read.call_count == 1
+
+    @pytest.mark.parametrize("b64_module", ["pybase64", "base64"])
+    def test_extract_epub_text_with_image(self, b64_module):
         """Images in EPUB should be embedded as data URIs in markdown."""
+        b64 = pytest.importorskip(b64_module)
         with tempfile.TemporaryDirectory() as temp_dir:
             epub_path = os.path.join(temp_dir, "img.epub")
             cache_path = os.path.join(temp_dir, "img_cache")
@@ -84,9 +105,10 @@ class TestEpubUtil:
                 patch("src.epub_util.epub.read_epub", return_value=mock_book),
                 patch("src.epub_util.extract_epub_metadata", return_value={}),
                 patch("src.epub_util.ebooklib.ITEM_DOCUMENT", 1),
+                patch("src.epub_util._b64", b64),
             ):
                 result = extract_epub_text(epub_path, cache_path)
-                assert "![pic](data:image/png;base64," in result
+                assert "![pic](data:image/png;base64,YmluYXJ5)" in result
 
     def test_stream_epub_markdown(self):
         """Streaming returns sequential chunk IDs with text."""
@@ -102,6 +124,17 @@ class TestEpubUtil:
             assert chunks[0]["chunk_id"] == 0
             assert all("text" in c for c in chunks)
 
+    def test_stream_epub_markdown_is_lazy(self):
+        """The first chunk is yielded before later paragraphs are split."""
+        sample_md = "\n\n".join(["para" + str(i) for i in range(20)])
+        with patch("src.epub_util.extract_epub_text", return_value=sample_md):
+            stream = stream_epub_markdown("x.epub", "x_cache", max_chars=50)
+            first = next(stream)
+            rest = list(stream)
+        expected = "\n".join("para" + str(i) for i in range(8))
+        assert first == {"chunk_id": 0, "text": expected}
+        assert [c["chunk_id"] for c in rest] == list(range(1, len(rest) + 1))
+
     def test_extract_epub_metadata_success(self):
         """Test successful metadata extraction."""
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -133,6 +166,26 @@ class TestEpubUtil:
 
                 assert result == {"title": "", "author": "", "year": ""}
 
+    def test_extract_epub_metadata_is_memoized_per_file_version(self):
+        """Unchanged files are read once; rewriting the file invalidates."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            epub_path = os.path.join(temp_dir, "cached.epub")
+            with open(epub_path, "w", encoding="utf-8") as f:
+                f.write("v1")
+
+            mock_book = MagicMock()
+            mock_book.get_metadata.return_value = [("Cached", {})]
+            with patch("src.epub_util.epub.read_epub", return_value=mock_book) as read:
+                first = extract_epub_metadata(epub_path)
+                first["title"] = "mutated by caller"
+                assert extract_epub_metadata(epub_path)["title"] == "Cached"
+                assert read.call_count == 1
+
+                with open(epub_path, "w", encoding="utf-8") as f:
+                    f.write("version 2")
+                extract_epub_metadata(epub_path)
+                assert read.call_count == 2
+
     def test_get_epub_cover_path_with_existing_cover(self):
         """Test cover path retrieval when cover already exists."""
         with tempfile.TemporaryDirectory() as temp_dir:
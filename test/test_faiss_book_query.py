@@ -43,3 +43,30 @@ def test_faiss_search_book_query_and_terms(tmp_path) -> None:
         assert "score" in top and "text" in top
         assert top["book_id"] == book_id
         assert top["score"] >= 0
+
+
+def test_faiss_search_batch_matches_single_queries(tmp_path) -> None:
+    epub_dir = Path("epub")
+    assert epub_dir.is_dir(), "epub ディレクトリが存在しない"
+    epub_files = sorted(epub_dir.glob("*.epub"))
+    assert epub_files, "EPUB ファイルが存在しない"
+
+    target = epub_files[0]
+    book_id = target.name[:-5]
+    queries = ["の", "Python", "メモリ", "Python 型"]
+
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    svc = MLXEmbeddingService(cache_dir=str(cache_dir))
+    try:
+        svc.add_book(book_id, str(target))
+    except RuntimeError as e:
+        msg = str(e).lower()
+        if "未サポート" in msg or "not supported" in msg:
+            pytest.skip("モデル未対応: " + msg)
+        raise
+
+    # バッチ検索はクエリごとの search と同じ結果を同じ順で返す
+    batch = svc.search_batch(queries, top_k=3, book_id=book_id)
+    assert batch == [svc.search(q, top_k=3, book_id=book_id) for q in queries]
+    assert all(r["book_id"] == book_id for res in batch for r in res)
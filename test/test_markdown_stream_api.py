@@ -1,32 +1,38 @@
 import json
 import os
-import tempfile
 
+import pytest
 from fastapi.testclient import TestClient
 
 import src.app as app_module
 
 
-def test_markdown_stream_endpoint(monkeypatch):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        epub_dir = os.path.join(tmpdir, "epub")
-        cache_dir = os.path.join(tmpdir, "cache")
-        os.makedirs(epub_dir)
-        os.makedirs(cache_dir)
-        open(os.path.join(epub_dir, "sample.epub"), "wb").close()
+# クライアントはモジュールで 1 つだけ作り、各テストは app_module の属性を
+# monkeypatch で差し替える (エンドポイントは呼び出し時に属性を参照する)
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app_module.app) as c:
+        yield c
 
-        monkeypatch.setattr(app_module, "EPUB_DIR", epub_dir)
-        monkeypatch.setattr(app_module, "CACHE_DIR", cache_dir)
 
-        def fake_stream(epub_path, cache_path, max_chars=800):
-            yield {"chunk_id": 0, "text": "hello"}
-            yield {"chunk_id": 1, "text": "world"}
+def test_markdown_stream_endpoint(client, monkeypatch, tmp_path):
+    epub_dir = os.path.join(tmp_path, "epub")
+    cache_dir = os.path.join(tmp_path, "cache")
+    os.makedirs(epub_dir)
+    os.makedirs(cache_dir)
+    open(os.path.join(epub_dir, "sample.epub"), "wb").close()
 
-        monkeypatch.setattr(app_module, "stream_epub_markdown", fake_stream)
+    monkeypatch.setattr(app_module, "EPUB_DIR", epub_dir)
+    monkeypatch.setattr(app_module, "CACHE_DIR", cache_dir)
 
-        client = TestClient(app_module.app)
-        resp = client.get("/book/sample.epub/markdown_stream")
-        assert resp.status_code == 200
-        lines = [json.loads(line) for line in resp.text.strip().split("\n")]
-        assert lines[0]["chunk_id"] == 0
-        assert lines[1]["text"] == "world"
+    def fake_stream(epub_path, cache_path, max_chars=800):
+        yield {"chunk_id": 0, "text": "hello"}
+        yield {"chunk_id": 1, "text": "world"}
+
+    monkeypatch.setattr(app_module, "stream_epub_markdown", fake_stream)
+
+    resp = client.get("/book/sample.epub/markdown_stream")
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.strip().split("\n")]
+    assert lines[0]["chunk_id"] == 0
+    assert lines[1]["text"] == "world"
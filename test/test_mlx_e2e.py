@@ -6,7 +6,10 @@ from pathlib import Path
 
 import pytest
 
-from src.mlx_embedding_service import MLXEmbeddingService
+# 収集時点で判定し、無効時はサービス (faiss 等) の import も行わない
+pytestmark = pytest.mark.skipif(
+    os.environ.get("RUN_MLX_E2E") != "1", reason="RUN_MLX_E2E=1 で有効化"
+)
 
 
 @pytest.mark.timeout(300)
@@ -20,9 +23,6 @@ def test_mlx_real_epub_end_to_end(tmp_path) -> None:  # noqa: D401
 
     条件を満たさない場合 / モデル未準備の場合は skip。
     """
-
-    if os.environ.get("RUN_MLX_E2E") != "1":
-        pytest.skip("RUN_MLX_E2E=1 で有効化")
     if platform.system() != "Darwin" or platform.machine() not in {"arm64", "arm"}:
         pytest.skip("Apple Silicon macOS 以外はスキップ")
 
@@ -42,6 +42,8 @@ def test_mlx_real_epub_end_to_end(tmp_path) -> None:  # noqa: D401
     cache_dir = tmp_path / "cache"
     cache_dir.mkdir()
 
+    from src.mlx_embedding_service import MLXEmbeddingService
+
     svc = MLXEmbeddingService(cache_dir=str(cache_dir), model_name=model_name)
 
     try:
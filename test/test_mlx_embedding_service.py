@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import faiss
+import numpy as np
+
+from src.mlx_embedding_service import MLXEmbeddingService, _norm
+
+
+def _write_md(cache_dir, book_id: str, paras: int) -> str:
+    body = "\n\n".join(f"{book_id} paragraph {i} " + "x" * 300 for i in range(paras))
+    (cache_dir / f"{book_id}.md").write_text(body, encoding="utf-8")
+    return str(cache_dir / f"{book_id}.epub")  # 存在しない epub (md キャッシュ利用)
+
+
+def test_norm_returns_unit_rows() -> None:
+    arr = np.array([[3.0, 4.0], [0.0, 2.0]])
+    out = _norm(arr)
+    assert out.dtype == np.float32
+    assert np.allclose(np.linalg.norm(out, axis=1), 1.0, atol=1e-6)
+    f32 = np.array([[3.0, 4.0]], dtype=np.float32)
+    assert _norm(f32) is f32
+
+
+def test_add_book_appends_incrementally(tmp_path) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 4))
+    first_total = svc.index.ntotal
+    svc.add_book("b2", _write_md(tmp_path, "b2", 6))
+
+    assert svc.index.ntotal == len(svc.chunks_metadata)
+    assert svc.index.ntotal > first_total
+    stats = svc.get_stats()
+    assert set(stats["books"]) == {"b1", "b2"}
+    res = svc.search("paragraph", top_k=2, book_id="b2")
+    assert res and all(r["book_id"] == "b2" for r in res)
+    # 列から引いた値は JSON 化できる素の Python 型で返る
+    top = svc.search("paragraph", top_k=1)[0]
+    assert type(top["chunk_id"]) is int and type(top["score"]) is float
+    assert type(top["book_id"]) is str
+
+
+def test_corpus_is_stored_in_fp16(tmp_path) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 4))
+    assert svc.embeddings.dtype == np.float16
+    assert isinstance(svc.index, faiss.IndexScalarQuantizer)
+    top = svc.search("paragraph", top_k=1)[0]
+    assert 0.0 < top["score"] <= 1.01
+
+
+def test_save_and_load_index_roundtrip(tmp_path) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 3))
+    svc.save_index()
+
+    fresh = MLXEmbeddingService(str(tmp_path))
+    assert fresh.load_index()
+    assert fresh.index.ntotal == len(fresh.chunks_metadata)
+    assert fresh.search("paragraph", top_k=1)
+
+
+def test_add_book_reads_index_from_disk_once(tmp_path, monkeypatch) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 3))
+    svc.save_index()
+
+    calls: list[str] = []
+    real_read = faiss.read_index
+
+    def counting_read(path: str):  # type: ignore[no-untyped-def]
+        calls.append(path)
+        return real_read(path)
+
+    monkeypatch.setattr(faiss, "read_index", counting_read)
+    warm = MLXEmbeddingService(str(tmp_path))
+    warm.add_book("b2", _write_md(tmp_path, "b2", 3))
+    warm.add_book("b3", _write_md(tmp_path, "b3", 3))
+    assert calls.count(warm.index_path) == 1
+    assert warm.index.ntotal == len(warm.chunks_metadata)
+
+
+def test_book_scoped_search_uses_persisted_hnsw(tmp_path, monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    monkeypatch.setattr(mes, "_HNSW_MIN_ROWS", 1)
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 8))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 8))
+    svc.save_index()
+    expected = svc.search("paragraph", top_k=3, book_id="b1")
+
+    fresh = MLXEmbeddingService(str(tmp_path))
+    assert fresh.load_index()
+    assert isinstance(fresh._book_map["b1"].index, faiss.IndexHNSWFlat)
+    res = fresh.search("paragraph", top_k=3, book_id="b1")
+    assert [r["chunk_id"] for r in res] == [r["chunk_id"] for r in expected]
+    assert all(r["book_id"] == "b1" for r in res)
+
+
+def test_small_book_is_searched_exactly_without_hnsw(tmp_path) -> None:
+    import os
+
+    import src.mlx_embedding_service as mes
+
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 8))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 8))
+    assert svc._book_map["b1"].index is None
+
+    res = svc.search("paragraph", top_k=3, book_id="b1")
+    idxs = np.asarray(svc._book_map["b1"].chunk_indices)
+    qv = mes._query_vecs(["paragraph"], svc.index.d)[0]
+    scores = svc.embeddings[idxs].astype(np.float32) @ qv
+    expected = svc._meta_chunk_id[idxs[np.argsort(-scores, kind="stable")[:3]]]
+    assert [r["chunk_id"] for r in res] == expected.tolist()
+    assert all(r["book_id"] == "b1" for r in res)
+    svc.save_index()
+    assert not os.path.exists(svc._book_index_path("b1"))
+
+
+def test_save_index_writes_only_new_book_indexes(tmp_path, monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    monkeypatch.setattr(mes, "_HNSW_MIN_ROWS", 1)
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 4))
+    svc.save_index()
+
+    written: list[str] = []
+    real_write = faiss.write_index
+
+    def recording_write(index, path):  # type: ignore[no-untyped-def]
+        written.append(path)
+        return real_write(index, path)
+
+    monkeypatch.setattr(faiss, "write_index", recording_write)
+    svc.add_book("b2", _write_md(tmp_path, "b2", 4))
+    svc.save_index()
+    assert svc._book_index_path("b2") in written
+    assert svc._book_index_path("b1") not in written
+    written.clear()
+    svc.save_index()
+    assert written == [svc.index_path]
+
+
+def test_metadata_is_saved_columnar_and_legacy_pickle_loads(tmp_path) -> None:
+    import os
+    import pickle
+
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 3))
+    svc.save_index()
+    assert os.path.exists(svc.meta_path) and os.path.exists(svc.text_path)
+    expected = svc.chunks_metadata
+
+    # 旧形式 (単一 pickle) しか無いキャッシュからも読める
+    with open(svc.legacy_meta_path, "wb") as f:
+        pickle.dump(expected, f)
+    os.remove(svc.meta_path)
+    os.remove(svc.text_path)
+    legacy = MLXEmbeddingService(str(tmp_path))
+    assert legacy.load_index()
+    assert legacy.chunks_metadata == expected
+    assert legacy.search("paragraph", top_k=1, book_id="b1")
+
+
+def test_gpu_offload_falls_back_to_cpu(tmp_path, monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 3))
+    svc.save_index()
+
+    # GPU が見えても転送に失敗する環境 (CPU 版ホイール等) では CPU のまま動く
+    monkeypatch.setenv(mes.FAISS_GPU_ENV, "1")
+    monkeypatch.setattr(faiss, "get_num_gpus", lambda: 1, raising=False)
+    fresh = MLXEmbeddingService(str(tmp_path))
+    assert fresh.load_index()
+    assert not fresh._on_gpu
+    assert isinstance(fresh.index, faiss.IndexScalarQuantizer)
+    assert fresh.search("paragraph", top_k=1)
+
+
+def test_sharded_search_matches_single_index(tmp_path, monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    svc = MLXEmbeddingService(str(tmp_path))
+    for i in range(3):
+        svc.add_book(f"b{i}", _write_md(tmp_path, f"b{i}", 10))
+    monkeypatch.setenv(mes.FAISS_SHARD_ENV, "1")
+    expected = svc.search("paragraph", top_k=7)
+
+    monkeypatch.setenv(mes.FAISS_SHARD_ENV, "4")
+    monkeypatch.setattr(mes, "_SHARD_MIN_ROWS", 1)
+    res = svc.search("paragraph", top_k=7)
+    assert svc._shards is not None and len(svc._shards) == 4
+    assert [(r["book_id"], r["chunk_id"]) for r in res] == [
+        (r["book_id"], r["chunk_id"]) for r in expected
+    ]
+
+    # シャード数が変わって再構築されてもプールは使い回す
+    pool = svc._shard_pool
+    monkeypatch.setenv(mes.FAISS_SHARD_ENV, "2")
+    assert svc.search("paragraph", top_k=7) == res
+    assert len(svc._shards) == 2 and svc._shard_pool is pool
+
+    # 追加した冊は末尾シャードへ追記され、全シャードの再構築は起きない
+    shards = svc._shards
+    svc.add_book("b3", _write_md(tmp_path, "b3", 10))
+    assert svc._shards is shards
+    assert sum(index.ntotal for _, index in shards) == len(svc.texts)
+    monkeypatch.setenv(mes.FAISS_SHARD_ENV, "1")
+    expected = svc.search("paragraph", top_k=7)
+    monkeypatch.setenv(mes.FAISS_SHARD_ENV, "2")
+    assert svc.search("paragraph", top_k=7) == expected
+
+
+def test_sharding_is_off_unless_configured(tmp_path, monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    monkeypatch.delenv(mes.FAISS_SHARD_ENV, raising=False)
+    monkeypatch.setattr(mes, "_SHARD_MIN_ROWS", 1)
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 10))
+    assert svc.search("paragraph", top_k=3)
+    assert svc._shards is None
+
+
+def test_configure_faiss_threads_applies_once(monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    calls: list[int] = []
+    monkeypatch.setattr(faiss, "omp_set_num_threads", calls.append)
+    monkeypatch.setenv(mes.FAISS_THREADS_ENV, "3")
+    mes.configure_faiss_threads.cache_clear()
+    try:
+        assert mes.configure_faiss_threads() == 3
+        monkeypatch.setenv(mes.FAISS_THREADS_ENV, "bogus")
+        assert mes.configure_faiss_threads() == 3
+        assert calls == [3]
+    finally:
+        # 後続テストでは実際の設定から取り直させる
+        mes.configure_faiss_threads.cache_clear()
+
+
+def test_configure_faiss_threads_keeps_default_when_unset(monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    calls: list[int] = []
+    monkeypatch.setattr(faiss, "omp_set_num_threads", calls.append)
+    monkeypatch.delenv(mes.FAISS_THREADS_ENV, raising=False)
+    mes.configure_faiss_threads.cache_clear()
+    try:
+        assert mes.configure_faiss_threads() == faiss.omp_get_max_threads()
+        assert calls == []
+    finally:
+        mes.configure_faiss_threads.cache_clear()
+
+
+def test_search_batch_matches_single_queries(tmp_path) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 6))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 6))
+    queries = ["paragraph", "x", "b2"]
+    for book_id in (None, "b1"):
+        batch = svc.search_batch(queries, top_k=3, book_id=book_id)
+        assert batch == [svc.search(q, top_k=3, book_id=book_id) for q in queries]
+    assert svc.search_batch([]) == []
+
+
+def test_add_book_grows_embeddings_buffer_in_place(tmp_path) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 8))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 2))
+    buf = svc.embeddings.base
+    svc.add_book("b3", _write_md(tmp_path, "b3", 2))  # 既存容量に収まる
+    assert svc.embeddings.base is buf
+    assert len(svc.embeddings) == svc.index.ntotal
+    stored = svc.index.reconstruct_n(0, svc.index.ntotal)
+    assert np.array_equal(svc.embeddings.astype(np.float32), stored)
+
+
+def test_book_chunks_returns_only_that_book(tmp_path) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 3))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 4))
+    expected = [
+        {"chunk_id": m["chunk_id"], "text": m["text"]}
+        for m in svc.chunks_metadata
+        if m["book_id"] == "b2"
+    ]
+    chunks = svc.book_chunks("b2")
+    assert chunks == expected and type(chunks[0]["chunk_id"]) is int
+    assert svc.book_chunks("missing") == []
+
+
+def test_load_index_picks_up_index_saved_by_another_process(tmp_path) -> None:
+    import os
+
+    writer = MLXEmbeddingService(str(tmp_path))
+    writer.add_book("b1", _write_md(tmp_path, "b1", 3))
+    writer.save_index()
+    reader = MLXEmbeddingService(str(tmp_path))
+    assert reader.load_index() and set(reader.get_stats()["books"]) == {"b1"}
+
+    writer.add_book("b2", _write_md(tmp_path, "b2", 3))
+    writer.save_index()
+    # 粗い mtime 分解能のファイルシステムでも差が出るよう明示的に進める
+    st = os.stat(writer.index_path)
+    os.utime(writer.index_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert reader.load_index()
+    assert set(reader.get_stats()["books"]) == {"b1", "b2"}
+    assert reader.index.ntotal == len(reader.texts)
+
+
+def test_search_books_encodes_query_once(tmp_path, monkeypatch) -> None:
+    import src.mlx_embedding_service as mes
+
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 6))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 6))
+    expected = {b: svc.search("paragraph", top_k=3, book_id=b) for b in ("b1", "b2")}
+
+    calls: list[list[str]] = []
+    real = mes._query_vecs
+
+    def counting(queries, dim):  # type: ignore[no-untyped-def]
+        calls.append(list(queries))
+        return real(queries, dim)
+
+    monkeypatch.setattr(mes, "_query_vecs", counting)
+    assert svc.search_books("paragraph", ["b1", "b2"], top_k=3) == expected
+    assert calls == [["paragraph"]]
+
+
+def test_search_books_isolates_a_failing_book(tmp_path, monkeypatch) -> None:
+    svc = MLXEmbeddingService(str(tmp_path))
+    svc.add_book("b1", _write_md(tmp_path, "b1", 6))
+    svc.add_book("b2", _write_md(tmp_path, "b2", 6))
+    expected = svc.search("paragraph", top_k=3, book_id="b2")
+    real = svc._search_vecs
+
+    def flaky(vecs, top_k, book_id):  # type: ignore[no-untyped-def]
+        if book_id == "b1":
+            raise RuntimeError("corrupt book index")
+        return real(vecs, top_k, book_id)
+
+    monkeypatch.setattr(svc, "_search_vecs", flaky)
+    # 失敗した書籍だけ None になり、呼び出し側はその書籍だけフォールバックする
+    assert svc.search_books("paragraph", ["b1", "b2"], top_k=3) == {
+        "b1": None,
+        "b2": expected,
+    }
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import json
+from pathlib import Path
+
+import pytest
 
 from src.rag_util import RAGPipeline, get_or_create_markdown
 
@@ -11,7 +14,7 @@ class DummyEmbeddingService:
     def __init__(self) -> None:
         self._loaded = False
         self._index_calls: list[str] = []
-        self._search_calls: list[dict[str, str | int | None]] = []
+        self._search_count = 0
         self._results = [
             {
                 "rank": 1,
@@ -41,10 +44,21 @@ class DummyEmbeddingService:
     def search(
         self, query: str, top_k: int, book_id: str | None
     ) -> list[dict[str, object]]:  # noqa: D401
-        self._search_calls.append({"query": query, "book_id": book_id, "top_k": top_k})
+        del query, book_id  # 引数未使用
+        self._search_count += 1
         return self._results[:top_k]
 
 
+@pytest.fixture
+def rag_dirs(tmp_path) -> tuple[Path, Path]:
+    """RAGPipeline 用の cache / epub ディレクトリを作る。"""
+    cache_dir = tmp_path / "cache"
+    epub_dir = tmp_path / "epub"
+    cache_dir.mkdir()
+    epub_dir.mkdir()
+    return cache_dir, epub_dir
+
+
 def test_get_or_create_markdown_cache_hit(tmp_path) -> None:
     md = tmp_path / "sample.md"
     md.write_text("# Title\nBody", encoding="utf-8")
@@ -53,6 +67,33 @@ def test_get_or_create_markdown_cache_hit(tmp_path) -> None:
     assert result == str(md)
 
 
+def test_get_or_create_markdown_regenerates_deleted_md(tmp_path, monkeypatch) -> None:
+    md = tmp_path / "known.md"
+    md.write_text("# t", encoding="utf-8")
+    epub_path = tmp_path / "known.epub"
+    first = get_or_create_markdown(str(epub_path), str(tmp_path))
+    assert first == str(md)
+
+    # キャッシュ掃除で md が消えたら、覚えていたパスは使わず作り直す
+    md.unlink()
+    epub_path.write_text("dummy", encoding="utf-8")
+    calls: list[str] = []
+
+    def fake_extract(path: str, cache: str) -> str:
+        calls.append(path)
+        md.write_text("# regenerated", encoding="utf-8")
+        return "# regenerated"
+
+    monkeypatch.setattr("src.rag_util.extract_epub_text", fake_extract)
+    assert get_or_create_markdown(str(epub_path), str(tmp_path)) == first
+    assert calls == [str(epub_path)]
+
+    md.unlink()
+    epub_path.unlink()
+    with pytest.raises(FileNotFoundError):
+        get_or_create_markdown(str(epub_path), str(tmp_path))
+
+
 def test_get_or_create_markdown_generate(tmp_path, monkeypatch) -> None:
     # epub を作成し、extract_epub_text をモックして md 作成シミュレート
     epub_path = tmp_path / "book.epub"
@@ -71,11 +112,8 @@ def test_get_or_create_markdown_generate(tmp_path, monkeypatch) -> None:
     assert md_path.exists()
 
 
-def test_rag_pipeline_search_cache_behavior(tmp_path) -> None:
-    cache_dir = tmp_path / "cache"
-    epub_dir = tmp_path / "epub"
-    cache_dir.mkdir()
-    epub_dir.mkdir()
+def test_rag_pipeline_search_cache_behavior(rag_dirs) -> None:
+    cache_dir, epub_dir = rag_dirs
     # ダミー epub
     (epub_dir / "book1.epub").write_text("dummy", encoding="utf-8")
 
@@ -85,28 +123,24 @@ def test_rag_pipeline_search_cache_behavior(tmp_path) -> None:
     # 1回目 (キャッシュ未使用)
     r1 = pipeline.search("hello", top_k=1, book_id="book1")
     assert len(r1) == 1
-    cache_file = cache_dir / "faiss_search_cache.json"
+    cache_file = cache_dir / "faiss_search_cache.jsonl"
     assert cache_file.exists()
-    data = json.loads(cache_file.read_text(encoding="utf-8"))
-    assert data.get("entries")
+    lines = cache_file.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)[0] for line in lines] == ["hello"]
 
     # 2回目 (キャッシュヒットで search 呼び出し増えない)
     r2 = pipeline.search("hello", top_k=1, book_id="book1")
     assert r2 == r1
-    # ダミーサービスでは search_calls を直接見ない (簡易検証)
-    assert r2 == r1
+    assert svc._search_count == 1
 
     # refresh 指定で再検索
     r3 = pipeline.search("hello", top_k=1, book_id="book1", cache_policy="refresh")
     assert r3 == r1
-    assert r3 == r1
+    assert svc._search_count == 2
 
 
-def test_rag_pipeline_add_book_without_epub(tmp_path) -> None:
-    cache_dir = tmp_path / "cache"
-    epub_dir = tmp_path / "epub"
-    cache_dir.mkdir()
-    epub_dir.mkdir()
+def test_rag_pipeline_add_book_without_epub(rag_dirs) -> None:
+    cache_dir, epub_dir = rag_dirs
 
     svc = DummyEmbeddingService()
     pipeline = RAGPipeline(str(cache_dir), str(epub_dir), embedding_service=svc)
@@ -114,3 +148,102 @@ def test_rag_pipeline_add_book_without_epub(tmp_path) -> None:
     (cache_dir / "alone.md").write_text("# t", encoding="utf-8")
     pipeline.add_book("alone")
     assert pipeline.search("hello", top_k=1)  # 例外なく検索できる
+
+
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_rag_pipeline_cache_lookup_survives_reload(
+    rag_dirs, monkeypatch, backend
+) -> None:
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr("src.rag_util.orjson", None)
+    cache_dir, epub_dir = rag_dirs
+
+    svc = DummyEmbeddingService()
+    pipeline = RAGPipeline(str(cache_dir), str(epub_dir), embedding_service=svc)
+    for i in range(20):
+        pipeline.search(f"q{i}", top_k=1)
+    assert svc._search_count == 20
+
+    # 別インスタンスでもディスクから復元したキャッシュに当たる
+    reloaded = RAGPipeline(str(cache_dir), str(epub_dir), embedding_service=svc)
+    assert reloaded.search("q7", top_k=1) == svc._results[:1]
+    assert reloaded.search("q7", top_k=2)  # top_k が違えば再検索
+    assert svc._search_count == 21
+
+
+def test_rag_pipeline_migrates_legacy_json_cache(rag_dirs) -> None:
+    cache_dir, epub_dir = rag_dirs
+    legacy = {
+        "updated_at": "2024-01-01T00:00:00+00:00",
+        "entries": [
+            {
+                "query": "old",
+                "book_id": None,
+                "top_k": 1,
+                "results": [{"text": "cached"}],
+                "created_at": "2024-01-01T00:00:00+00:00",
+                "chunks_total": 1,
+            }
+        ],
+    }
+    (cache_dir / "faiss_search_cache.json").write_text(
+        json.dumps(legacy), encoding="utf-8"
+    )
+    svc = DummyEmbeddingService()
+    pipeline = RAGPipeline(str(cache_dir), str(epub_dir), embedding_service=svc)
+    assert pipeline.search("old", top_k=1) == [{"text": "cached"}]
+    pipeline.search("new", top_k=1)
+
+    # 移行後は JSONL に旧エントリ + 追記分が 1 行ずつ並ぶ (壊れた末尾行は無視)
+    cache_file = cache_dir / "faiss_search_cache.jsonl"
+    with cache_file.open("a", encoding="utf-8") as f:
+        f.write('{"query": "tru')
+    queries = [
+        json.loads(line)[0]
+        for line in cache_file.read_text(encoding="utf-8").splitlines()[:2]
+    ]
+    assert queries == ["old", "new"]
+    reloaded = RAGPipeline(str(cache_dir), str(epub_dir), embedding_service=svc)
+    assert reloaded.search("new", top_k=1) == svc._results[:1]
+    assert svc._search_count == 1
+    assert len(cache_file.read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_rag_pipeline_creates_default_service_lazily(tmp_path) -> None:
+    from src.mlx_embedding_service import MLXEmbeddingService
+
+    pipeline = RAGPipeline(str(tmp_path / "cache"), str(tmp_path / "epub"))
+    assert pipeline._embedding_service is None
+    svc = pipeline.embedding_service
+    assert isinstance(svc, MLXEmbeddingService)
+    assert pipeline.embedding_service is svc
+
+
+def test_rag_pipeline_cache_hit_skips_index_and_stats(rag_dirs, monkeypatch) -> None:
+    cache_dir, epub_dir = rag_dirs
+    svc = DummyEmbeddingService()
+    pipeline = RAGPipeline(str(cache_dir), str(epub_dir), embedding_service=svc)
+    pipeline.search("hello", top_k=1)
+
+    calls: list[str] = []
+    monkeypatch.setattr(svc, "get_stats", lambda: calls.append("stats") or {})
+    monkeypatch.setattr(svc, "load_index", lambda: calls.append("load") or True)
+    assert pipeline.search("hello", top_k=1) == svc._results[:1]
+    assert calls == []
+
+    # TTL 切れ後は total_chunks を取り直してから照合する
+    monkeypatch.setattr("src.rag_util._CHUNKS_TOTAL_TTL_SEC", 0.0)
+    pipeline.search("hello", top_k=1)
+    assert calls == ["load", "stats"]
+
+
+def test_search_cache_entry_row_roundtrip() -> None:
+    from src.rag_util import SearchCacheEntry
+
+    entry = SearchCacheEntry("q", None, 3, [{"text": "t"}], "2024-01-01", 5)
+    assert SearchCacheEntry.from_row(json.loads(json.dumps(entry.to_row()))) == entry
+    # 配列化前の dict 行も読める
+    legacy = {"query": "q", "top_k": 3, "results": [{"text": "t"}]}
+    assert SearchCacheEntry.from_row(legacy).top_k == 3
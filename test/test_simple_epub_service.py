@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import os
+
+from src.simple_epub_service import SimpleEPUBService
+
+
+def _service(tmp_path, monkeypatch) -> tuple[SimpleEPUBService, list[str]]:
+    epub_dir = tmp_path / "epub"
+    epub_dir.mkdir()
+    svc = SimpleEPUBService(str(epub_dir), embedding_model="dummy-model")
+    calls: list[str] = []
+
+    def fake_book_list(path: str) -> list[dict[str, str]]:
+        calls.append(path)
+        return [
+            {"id": f.name, "title": f"Title of {f.name}"}
+            for f in os.scandir(path)
+            if f.name.endswith(".epub")
+        ]
+
+    monkeypatch.setattr("src.simple_epub_service.get_book_list", fake_book_list)
+    monkeypatch.setattr(svc, "ensure_index_loaded", lambda: None)
+    monkeypatch.setattr(
+        svc.embedding_service,
+        "search",
+        lambda query, top_k: [{"book_id": "b1", "text": query, "score": 1.0}],
+    )
+    return svc, calls
+
+
+def test_search_all_books_caches_titles(tmp_path, monkeypatch) -> None:
+    svc, calls = _service(tmp_path, monkeypatch)
+    (tmp_path / "epub" / "b1.epub").write_text("x", encoding="utf-8")
+
+    first = svc.search_all_books("q")
+    svc.search_all_books("q")
+    assert first[0]["book_title"] == "Title of b1.epub"
+    assert first[0]["book_id"] == "b1.epub"
+    assert len(calls) == 1
+
+    (tmp_path / "epub" / "b2.epub").write_text("x", encoding="utf-8")
+    os.utime(tmp_path / "epub", ns=(0, 10**18))  # mtime 粒度に依存しないよう明示
+    svc.search_all_books("q")
+    assert len(calls) == 2
+
+
+def test_search_all_books_skips_status_entries(tmp_path, monkeypatch) -> None:
+    svc, _ = _service(tmp_path, monkeypatch)
+    hits = [{"book_id": "b1", "text": "t"}, {"message": "no results"}]
+    monkeypatch.setattr(svc.embedding_service, "search", lambda query, top_k: hits)
+    res = svc.search_all_books("q")
+    assert res == [{"book_id": "b1.epub", "text": "t", "book_title": "Unknown"}]